@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Deterministic generator of synthetic presence data.
+
+Writes CSV presence data and users XML in the formats of files from
+runtime/data. The same arguments always produce the same files.
+
+Usage: bin/python-console benchmarks/generate.py rows users csv [xml]
+"""
+from __future__ import unicode_literals
+
+import argparse
+import random
+from datetime import date, timedelta
+
+
+FIRST_DAY = date(2011, 6, 1)
+FIRST_NAMES = (
+    'Adam', 'Adrian', 'Agnieszka', 'Anna', 'Bartosz', 'Ewa', 'Jan',
+    'Katarzyna', 'Łukasz', 'Magdalena', 'Marcin', 'Piotr', 'Zofia',
+)
+
+
+def working_days(count):
+    """
+    Returns 'count' consecutive working days from FIRST_DAY.
+    """
+    days = []
+    day = FIRST_DAY
+    while len(days) < count:
+        if day.weekday() < 5:
+            days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def format_time(seconds):
+    """
+    Formats seconds since midnight as 'HH:MM:SS'.
+    """
+    return '{0:02d}:{1:02d}:{2:02d}'.format(
+        seconds // 3600, seconds // 60 % 60, seconds % 60
+    )
+
+
+def generate_csv(path, rows, users, seed=0):
+    """
+    Writes about 'rows' presence entries of 'users' users grouped by user.
+    """
+    rng = random.Random(seed)
+    per_user = max(rows // users, 1)
+    days = [day.isoformat() for day in working_days(per_user)]
+    written = 0
+    with open(path, 'w') as csvfile:
+        for user_id in range(1, users + 1):
+            lines = []
+            for day in days[:min(per_user, rows - written)]:
+                start = rng.randint(7 * 3600, 11 * 3600)
+                end = min(start + rng.randint(3600, 10 * 3600), 86399)
+                lines.append('{0},{1},{2},{3}\n'.format(
+                    user_id, day, format_time(start), format_time(end)
+                ))
+            csvfile.write(''.join(lines).encode('utf-8'))
+            written += len(lines)
+    return written
+
+
+def generate_xml(path, users, seed=0):
+    """
+    Writes users XML with 'users' users named at random.
+    """
+    rng = random.Random(seed)
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n<intranet>\n'
+        '    <server>\n'
+        '        <host>intranet.stxnext.pl</host>\n'
+        '        <port>443</port>\n'
+        '        <protocol>https</protocol>\n'
+        '    </server>\n'
+        '    <users>\n'
+    ]
+    for user_id in range(1, users + 1):
+        parts.append(
+            '        <user id="{0}">\n'
+            '            <avatar>/api/images/users/{0}</avatar>\n'
+            '            <name>{1} {2}.</name>\n'
+            '        </user>\n'.format(
+                user_id,
+                rng.choice(FIRST_NAMES),
+                chr(rng.randint(ord('A'), ord('Z')))
+            )
+        )
+    parts.append('    </users>\n</intranet>\n')
+    with open(path, 'w') as xmlfile:
+        xmlfile.write(''.join(parts).encode('utf-8'))
+
+
+def run():
+    """
+    Generates files given in command line arguments.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('rows', type=int)
+    parser.add_argument('users', type=int)
+    parser.add_argument('csv')
+    parser.add_argument('xml', nargs='?')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print 'rows: {0}'.format(
+        generate_csv(args.csv, args.rows, args.users, args.seed)
+    )
+    if args.xml:
+        generate_xml(args.xml, args.users, args.seed)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Memory benchmark of loaded presence data.
+
+Compares the old nested dict of date/time objects with the columnar
+store built by get_data() on scaled-up sample data.
+
+Usage: bin/python-console benchmarks/memory.py [scale]
+"""
+from __future__ import unicode_literals
+
+import csv
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+from presence_analyzer import main, utils
+
+
+SAMPLE_DATA_CSV = os.path.join(
+    os.path.dirname(__file__), '..', 'runtime', 'data', 'sample_data.csv'
+)
+
+
+def scale_csv(source, target, scale):
+    """
+    Writes source rows 'scale' times, every copy with shifted user ids.
+    """
+    with open(source, 'r') as infile:
+        rows = [row for row in csv.reader(infile) if len(row) == 4]
+    with open(target, 'w') as outfile:
+        writer = csv.writer(outfile, lineterminator=str('\n'))
+        for copy in range(scale):
+            for row in rows:
+                writer.writerow([int(row[0]) + copy * 1000] + row[1:])
+    return len(rows) * scale
+
+
+def legacy_get_data(path):
+    """
+    Loads presence data into the old nested dict structure.
+    """
+    data = {}
+    with open(path, 'r') as csvfile:
+        for row in csv.reader(csvfile, delimiter=str(',')):
+            if len(row) != 4:
+                continue
+            user_id = int(row[0])
+            date = datetime.strptime(row[1], '%Y-%m-%d').date()
+            start = datetime.strptime(row[2], '%H:%M:%S').time()
+            end = datetime.strptime(row[3], '%H:%M:%S').time()
+            data.setdefault(user_id, {})[date] = {'start': start, 'end': end}
+    return data
+
+
+def deep_sizeof(obj, seen=None):
+    """
+    Returns size in bytes of object and everything it references.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.iteritems():
+            size += deep_sizeof(key, seen) + deep_sizeof(value, seen)
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            size += deep_sizeof(item, seen)
+    elif isinstance(obj, utils.UserPresence):
+        for name in obj.__slots__:
+            size += deep_sizeof(getattr(obj, name), seen)
+    return size
+
+
+def run(scale):
+    """
+    Prints memory used by both structures.
+    """
+    handle, path = tempfile.mkstemp(suffix='.csv')
+    os.close(handle)
+    try:
+        rows = scale_csv(SAMPLE_DATA_CSV, path, scale)
+        legacy = deep_sizeof(legacy_get_data(path))
+        main.app.config.update({'DATA_CSV': path})
+        columnar = deep_sizeof(utils.get_data())
+    finally:
+        os.remove(path)
+
+    print 'rows:           {0}'.format(rows)
+    print 'nested dict:    {0:.1f} MiB'.format(legacy / 1048576.0)
+    print 'columnar store: {0:.1f} MiB'.format(columnar / 1048576.0)
+    print 'reduction:      {0:.1f}x'.format(float(legacy) / columnar)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
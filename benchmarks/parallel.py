@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of loading presence data by a pool of worker processes.
+
+Prints load time of synthetic data for 1, 2, 4... workers up to the
+number of CPUs and speedup against serial loading.
+
+Usage: bin/python-console benchmarks/parallel.py [rows] [users]
+"""
+from __future__ import unicode_literals
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from multiprocessing import cpu_count
+
+from generate import generate_csv
+from presence_analyzer import main, utils
+
+
+def load_time(path, workers):
+    """
+    Returns time of loading whole file with given number of workers.
+    """
+    main.app.config.update({'DATA_LOAD_WORKERS': workers})
+    utils.LOADED.clear()
+    started = time.time()
+    utils.load_data(path)
+    return time.time() - started
+
+
+def run(rows, users):
+    """
+    Prints load times for growing number of workers.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'data.csv')
+        generate_csv(path, rows, users)
+        print 'rows: {0}, CPUs: {1}'.format(rows, cpu_count())
+        workers = 1
+        serial = None
+        while workers <= cpu_count():
+            elapsed = load_time(path, workers)
+            serial = serial or elapsed
+            print '{0:3} workers: {1:.3f} s, speedup {2:.1f}x'.format(
+                workers, elapsed, serial / elapsed
+            )
+            workers *= 2
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    run(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1000000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    )
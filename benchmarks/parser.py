@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark of presence row parsers.
+
+Compares rows per second of the strptime based parser with parse_row().
+
+Usage: bin/python-console benchmarks/parser.py [repeat]
+"""
+from __future__ import unicode_literals
+
+import csv
+import os
+import sys
+import time
+from datetime import datetime
+
+from presence_analyzer import utils
+
+
+SAMPLE_DATA_CSV = os.path.join(
+    os.path.dirname(__file__), '..', 'runtime', 'data', 'sample_data.csv'
+)
+
+
+def strptime_row(row, days=None):  # pylint: disable=unused-argument
+    """
+    Parses row the way get_data() used to.
+    """
+    return (
+        int(row[0]),
+        datetime.strptime(row[1], '%Y-%m-%d').toordinal(),
+        utils.seconds_since_midnight(
+            datetime.strptime(row[2], '%H:%M:%S').time()
+        ),
+        utils.seconds_since_midnight(
+            datetime.strptime(row[3], '%H:%M:%S').time()
+        ),
+    )
+
+
+def rows_per_second(parser, rows, repeat):
+    """
+    Returns best rows per second rate of parser over all rows.
+    """
+    best = None
+    for __ in range(repeat):
+        days = {}
+        started = time.time()
+        for row in rows:
+            parser(row, days)
+        elapsed = time.time() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return len(rows) / best
+
+
+def run(repeat):
+    """
+    Prints parsing rate of both parsers.
+    """
+    with open(SAMPLE_DATA_CSV, 'r') as csvfile:
+        rows = [row for row in csv.reader(csvfile) if len(row) == 4]
+
+    legacy = rows_per_second(strptime_row, rows, repeat)
+    fast = rows_per_second(utils.parse_row, rows, repeat)
+    print 'rows:      {0}'.format(len(rows))
+    print 'strptime:  {0:.0f} rows/s'.format(legacy)
+    print 'parse_row: {0:.0f} rows/s'.format(fast)
+    print 'speedup:   {0:.1f}x'.format(fast / legacy)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite of data loading and JSON API endpoints.
+
+For every size synthetic data is generated and measured in a separate
+process: cold load time of get_data(), peak memory, time of refresh
+after rows were appended and latency of endpoints through the Flask test
+client. Results are printed, and written as JSON with --output, so runs
+can be compared.
+
+Usage: bin/python-console benchmarks/suite.py --sizes 10000,1000000
+"""
+from __future__ import unicode_literals
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from generate import generate_csv, generate_xml
+
+
+ENDPOINTS = (
+    '/api/v1/users',
+    '/api/v2/users',
+    '/api/v1/mean_time_weekday/{user_id}',
+    '/api/v1/presence_weekday/{user_id}',
+    '/api/v2/total_hour/{user_id}',
+    '/api/v1/mean_time_start_end/{user_id}',
+    '/api/v2/stats?user_id={user_ids}',
+)
+
+
+def peak_memory():
+    """
+    Returns peak resident memory of this process in KiB.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def append_rows(path, rows, users):
+    """
+    Appends 'rows' entries on days after generated ones.
+    """
+    first_day = date(2100, 1, 1)
+    with open(path, 'a') as csvfile:
+        for i in range(rows):
+            csvfile.write('{0},{1},09:00:00,17:00:00\n'.format(
+                i % users + 1,
+                (first_day + timedelta(days=i // users)).isoformat()
+            ))
+
+
+def percentile(values, fraction):
+    """
+    Returns value at given fraction of sorted values.
+    """
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def measure(csv_path, xml_path, users, requests):
+    """
+    Measures one data set, it should run in a fresh process.
+    """
+    from presence_analyzer import main, utils
+
+    main.app.config.update({'DATA_CSV': csv_path, 'DATA_XML': xml_path})
+    result = {'memory_before_kib': peak_memory()}
+
+    started = time.time()
+    data = utils.get_data()
+    result['cold_load_s'] = time.time() - started
+    result['peak_memory_kib'] = peak_memory()
+    result['rows'] = sum(len(user) for user in data.values())
+    result['users'] = len(data)
+
+    appended = max(result['rows'] // 1000, 1)
+    append_rows(csv_path, appended, users)
+    utils.CACHE.clear()
+    started = time.time()
+    utils.get_data()
+    result['refresh_s'] = time.time() - started
+    result['refresh_rows'] = appended
+
+    client = main.app.test_client()
+    user_ids = ','.join(str(user_id) for user_id in range(1, 101))
+    result['endpoints'] = {}
+    for endpoint in ENDPOINTS:
+        timings = []
+        for i in range(requests + 1):
+            url = endpoint.format(user_id=i % users + 1, user_ids=user_ids)
+            started = time.time()
+            response = client.get(url)
+            timings.append((time.time() - started) * 1000)
+            assert response.status_code == 200, url
+        timings = timings[1:]  # the first request fills caches
+        result['endpoints'][endpoint] = {
+            'median_ms': percentile(timings, 0.5),
+            'p95_ms': percentile(timings, 0.95),
+        }
+    return result
+
+
+def run_size(rows, users, requests):
+    """
+    Generates data set of given size and measures it in a subprocess.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        csv_path = os.path.join(directory, 'data.csv')
+        xml_path = os.path.join(directory, 'users.xml')
+        generate_csv(csv_path, rows, users)
+        generate_xml(xml_path, users)
+        output = subprocess.check_output([
+            sys.executable, __file__, '--measure', csv_path, xml_path,
+            '--users', str(users), '--requests', str(requests),
+        ])
+    finally:
+        shutil.rmtree(directory)
+    return json.loads(output.splitlines()[-1])
+
+
+def report(result):
+    """
+    Prints human readable summary of one data set.
+    """
+    print '{rows} rows, {users} users'.format(**result)
+    print '  cold load:   {0:.3f} s'.format(result['cold_load_s'])
+    print '  peak memory: {0:.1f} MiB'.format(
+        result['peak_memory_kib'] / 1024.0
+    )
+    print '  refresh:     {0:.4f} s ({1} new rows)'.format(
+        result['refresh_s'], result['refresh_rows']
+    )
+    for endpoint, timing in sorted(result['endpoints'].items()):
+        print '  {0:40} {1:8.2f} ms median {2:8.2f} ms p95'.format(
+            endpoint, timing['median_ms'], timing['p95_ms']
+        )
+
+
+def run():
+    """
+    Runs benchmarks given in command line arguments.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--output')
+    parser.add_argument('--measure', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print json.dumps(measure(
+            args.measure[0], args.measure[1], args.users, args.requests
+        ))
+        return
+
+    results = []
+    for rows in [int(size) for size in args.sizes.split(',')]:
+        results.append(run_size(rows, args.users, args.requests))
+        report(results[-1])
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(
+                {'python': sys.version, 'results': results},
+                output,
+                indent=2,
+                sort_keys=True
+            )
+
+
+if __name__ == '__main__':
+    run()
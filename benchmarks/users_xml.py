@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of parsing large users XML.
+
+Compares the old parser building the whole lxml tree with the streaming
+parse_xml() on synthetic XML. Every parser runs in a separate process,
+so its peak memory is measured alone.
+
+Usage: bin/python-console benchmarks/users_xml.py [users]
+"""
+from __future__ import unicode_literals
+
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from lxml import etree
+
+from generate import generate_xml
+from presence_analyzer import main, utils
+
+
+def legacy_parse_xml(path):
+    """
+    Extracts users with etree.parse and findall, as parse_xml() used to.
+    """
+    data = {}
+    root = etree.parse(path).getroot()
+    serv = '{}://{}:{}'.format(
+        root.findtext('./server/protocol'),
+        root.findtext('./server/host'),
+        root.findtext('./server/port')
+    )
+    for user in root.findall('./users/user'):
+        data[int(user.get('id'))] = {
+            'name': user.find('name').text,
+            'avatar': ''.join((serv, user.find('avatar').text)),
+        }
+    return data
+
+
+def streaming_parse_xml(path):
+    """
+    Extracts users with parse_xml().
+    """
+    main.app.config.update({'DATA_XML': path})
+    return utils.parse_xml()
+
+
+PARSERS = {
+    'tree': legacy_parse_xml,
+    'iterparse': streaming_parse_xml,
+}
+
+
+def measure(parser, path):
+    """
+    Prints time and peak memory growth of parsing, run in a fresh process.
+    """
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.time()
+    users = len(PARSERS[parser](path))
+    elapsed = time.time() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print '{0} {1} {2}'.format(users, elapsed, peak - before)
+
+
+def run(users):
+    """
+    Prints time and memory of both parsers.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'users.xml')
+        generate_xml(path, users)
+        print 'users: {0}, file: {1:.1f} MiB'.format(
+            users, os.path.getsize(path) / 1048576.0
+        )
+        for parser in sorted(PARSERS):
+            output = subprocess.check_output([
+                sys.executable, __file__, '--measure', parser, path
+            ])
+            parsed, elapsed, memory = output.split()
+            print '{0:10} {1} users in {2:.3f} s, +{3:.1f} MiB'.format(
+                parser, parsed, float(elapsed), int(memory) / 1024.0
+            )
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--measure']:
+        measure(sys.argv[2], sys.argv[3])
+    else:
+        run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -30,6 +30,9 @@ setup(
         'Flask-Mako',
         'ipdb'
     ],
+    extras_require={
+        'numpy': ['numpy'],
+    },
     entry_points="""
     [console_scripts]
     flask-ctl = presence_analyzer.script:run
@@ -2,3 +2,29 @@
 """
 Helper functions used in templates.
 """
+from __future__ import unicode_literals
+
+from flask import url_for
+
+from presence_analyzer.main import app
+from presence_analyzer.utils import get_static
+
+
+def static_url(filename):
+    """
+    Returns URL of static file fingerprinted with hash of its content.
+
+    In debug mode files may change, so plain URL is returned.
+    """
+    fingerprinted = None
+    if not app.debug:
+        fingerprinted = get_static()['fingerprints'].get(filename)
+    return url_for('static', filename=fingerprinted or filename)
+
+
+@app.context_processor
+def template_helpers():
+    """
+    Makes helpers available in templates.
+    """
+    return {'static_url': static_url}
@@ -2,7 +2,81 @@
 """
 Flask app initialization.
 """
-from flask import Flask
+import os
+import errno
+import random
+import cProfile
+from datetime import datetime
+
+from flask import Flask, g, request
 
 
 app = Flask(__name__)  # pylint: disable=invalid-name
+
+
+@app.before_request
+def start_profile():
+    """
+    Profiles request when PROFILE is set and the request is chosen.
+
+    Request is chosen by 'X-Profile' header or 'profile' query argument,
+    and with PROFILE_SAMPLE probability otherwise.
+    """
+    if not app.config.get('PROFILE'):
+        return
+    if (
+            'X-Profile' not in request.headers and
+            'profile' not in request.args and
+            random.random() >= app.config.get('PROFILE_SAMPLE', 0)
+    ):
+        return
+    g.profile = cProfile.Profile()
+    g.profile.enable()
+
+
+@app.after_request
+def save_profile(response):
+    """
+    Names the file with request profile in 'X-Profile' header.
+    """
+    path = stop_profile()
+    if path:
+        response.headers['X-Profile'] = os.path.basename(path)
+    return response
+
+
+@app.teardown_request
+def teardown_profile(exception):  # pylint: disable=unused-argument
+    """
+    Saves profile of request that failed.
+    """
+    stop_profile()
+
+
+def stop_profile():
+    """
+    Stops profiling request and writes stats to PROFILE_DIR.
+
+    Returns path of written .pstats file or None if request was not
+    profiled.
+    """
+    profile = getattr(g, 'profile', None)
+    if profile is None:
+        return None
+    profile.disable()
+    del g.profile
+
+    directory = app.config.get('PROFILE_DIR', os.path.join('var', 'profile'))
+    try:
+        os.makedirs(directory)
+    except OSError as error:
+        # created already, possibly by another request at the same time
+        if error.errno != errno.EEXIST or not os.path.isdir(directory):
+            raise
+    path = os.path.join(directory, '{0}-{1}-{2}.pstats'.format(
+        datetime.now().strftime('%Y%m%d-%H%M%S-%f'),
+        os.getpid(),
+        (request.endpoint or 'unknown').replace('.', '-')
+    ))
+    profile.dump_stats(path)
+    return path
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentation of requests, caches and data loads for /metrics.
+"""
+from __future__ import unicode_literals
+
+import threading
+
+LOCK = threading.Lock()
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# name: (type, help)
+METRICS = {
+    'presence_requests_total': (
+        'counter', 'Requests to JSON API by route and status.'
+    ),
+    'presence_request_duration_seconds': (
+        'histogram', 'Time spent answering JSON API requests by route.'
+    ),
+    'presence_cache_hits_total': (
+        'counter', 'Results returned from cache by cached function.'
+    ),
+    'presence_cache_misses_total': (
+        'counter', 'Results computed on cache miss by cached function.'
+    ),
+    'presence_cache_stale_total': (
+        'counter', 'Obsolete results returned while refreshed in background.'
+    ),
+    'presence_cache_evictions_total': (
+        'counter', 'Results evicted as least recently used.'
+    ),
+    'presence_data_load_duration_seconds': (
+        'histogram', 'Time spent loading presence data by load mode.'
+    ),
+    'presence_data_rows': ('gauge', 'Presence entries of loaded data.'),
+    'presence_data_users': ('gauge', 'Users of loaded presence data.'),
+}
+SAMPLES = {}  # (name, labels): counter or gauge value, or histogram
+CACHES = {}  # cached function name: its memoize stats
+
+
+def increment(name, **labels):
+    """
+    Increments counter with given labels.
+    """
+    key = (name, tuple(sorted(labels.iteritems())))
+    with LOCK:
+        SAMPLES[key] = SAMPLES.get(key, 0) + 1
+
+
+def set_gauge(name, value, **labels):
+    """
+    Sets gauge with given labels to value.
+    """
+    SAMPLES[(name, tuple(sorted(labels.iteritems())))] = value
+
+
+def observe(name, seconds, **labels):
+    """
+    Records duration in histogram with given labels.
+
+    Histogram is a list of counts in BUCKETS, followed by the number and
+    the sum of all durations.
+    """
+    key = (name, tuple(sorted(labels.iteritems())))
+    with LOCK:
+        histogram = SAMPLES.get(key)
+        if histogram is None:
+            histogram = SAMPLES[key] = [0] * len(BUCKETS) + [0, 0.0]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram[i] += 1
+        histogram[-2] += 1
+        histogram[-1] += seconds
+
+
+def register_cache(name, stats):
+    """
+    Exposes counters of memoized function.
+    """
+    CACHES[name] = stats
+
+
+def format_labels(labels):
+    """
+    Formats labels as '{name="value",...}'.
+    """
+    if not labels:
+        return ''
+    return '{{{0}}}'.format(','.join(
+        '{0}="{1}"'.format(
+            name,
+            '{0}'.format(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n')
+        )
+        for name, value in labels
+    ))
+
+
+def format_sample(name, labels, value):
+    """
+    Formats lines of single sample, all bucket lines for histogram.
+    """
+    if not isinstance(value, list):
+        return ['{0}{1} {2}'.format(name, format_labels(labels), value)]
+    lines = []
+    for bound, count in zip(BUCKETS + ('+Inf',), value[:-2] + [value[-2]]):
+        lines.append('{0}_bucket{1} {2}'.format(
+            name, format_labels(labels + (('le', bound),)), count
+        ))
+    lines.append('{0}_count{1} {2}'.format(
+        name, format_labels(labels), value[-2]
+    ))
+    lines.append('{0}_sum{1} {2!r}'.format(
+        name, format_labels(labels), value[-1]
+    ))
+    return lines
+
+
+def render():
+    """
+    Returns all metrics in Prometheus text exposition format.
+    """
+    with LOCK:
+        samples = dict(
+            (key, list(value) if isinstance(value, list) else value)
+            for key, value in SAMPLES.iteritems()
+        )
+    for cache, stats in CACHES.items():
+        for counter in ('hits', 'misses', 'stale', 'evictions'):
+            name = 'presence_cache_{0}_total'.format(counter)
+            samples[(name, (('function', cache),))] = stats[counter]
+
+    lines = []
+    for name in sorted(METRICS):
+        kind, description = METRICS[name]
+        lines.append('# HELP {0} {1}'.format(name, description))
+        lines.append('# TYPE {0} {1}'.format(name, kind))
+        for key in sorted(key for key in samples if key[0] == name):
+            lines.extend(format_sample(name, key[1], samples[key]))
+    return '\n'.join(lines) + '\n'
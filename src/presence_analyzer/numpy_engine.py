@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Presence statistics computed with NumPy, enabled by PRESENCE_ENGINE.
+"""
+from __future__ import unicode_literals
+
+import threading
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None  # pylint: disable=invalid-name
+
+ARRAYS = {}  # PresenceArrays of the latest data generation
+LOCK = threading.Lock()
+
+
+class PresenceArrays(object):
+    """
+    Presence data of all users as NumPy arrays with per weekday totals.
+
+    Columns of all users are concatenated into arrays of user index, day
+    ordinal, start and end seconds. Totals are computed with bincount
+    grouped by user index and weekday.
+    """
+    def __init__(self, data):
+        if numpy is None:
+            raise RuntimeError("PRESENCE_ENGINE 'numpy' requires numpy")
+        user_ids = sorted(data)
+        self.index = {user_id: i for i, user_id in enumerate(user_ids)}
+        counts = [len(data[user_id]) for user_id in user_ids]
+
+        self.users = numpy.repeat(
+            numpy.arange(len(user_ids), dtype=numpy.int64), counts
+        )
+        self.days = self._column(data, user_ids, 'days')
+        self.starts = self._column(data, user_ids, 'starts')
+        self.ends = self._column(data, user_ids, 'ends')
+
+        weekdays = (self.days + 6) % 7
+        groups = self.users * 7 + weekdays
+        size = len(user_ids) * 7
+        intervals = self.ends - self.starts
+        self.totals = numpy.stack([
+            numpy.bincount(groups, minlength=size),
+            self._sum(groups, intervals, size),
+            self._sum(groups, self.starts, size),
+            self._sum(groups, self.ends, size),
+        ], axis=-1).reshape(len(user_ids), 7, 4)
+        self.organisation = self._sum(weekdays, intervals, 7)
+
+    @staticmethod
+    def _column(data, user_ids, name):
+        """
+        Concatenates given column of all users into int64 array.
+        """
+        if not user_ids:
+            return numpy.zeros(0, dtype=numpy.int64)
+        columns = [getattr(data[user_id], name) for user_id in user_ids]
+        return numpy.concatenate([
+            numpy.frombuffer(
+                # snapshot columns are views of the mapped file
+                getattr(column, 'buffer', column), dtype=numpy.int32
+            )
+            for column in columns
+        ]).astype(numpy.int64)
+
+    @staticmethod
+    def _sum(groups, values, size):
+        """
+        Sums integer values by group, exactly as Python would.
+        """
+        return numpy.bincount(
+            groups, weights=values, minlength=size
+        ).round().astype(numpy.int64)
+
+    def weekday_totals(self, user_id):
+        """
+        Returns (count, intervals, starts, ends) sums for every weekday.
+        """
+        return [
+            tuple(int(value) for value in totals)
+            for totals in self.totals[self.index[user_id]]
+        ]
+
+    def organisation_totals(self):
+        """
+        Returns sums of intervals of all users for every weekday.
+        """
+        return tuple(int(value) for value in self.organisation)
+
+
+def get_arrays(data):
+    """
+    Returns PresenceArrays of given data, built once per data generation.
+    """
+    arrays = ARRAYS.get(data.generation)
+    if arrays is None:
+        with LOCK:
+            arrays = ARRAYS.get(data.generation)
+            if arrays is None:
+                arrays = PresenceArrays(data)
+                ARRAYS.clear()
+                ARRAYS[data.generation] = arrays
+    return arrays
+
+
+def weekday_totals(data, user_id):
+    """
+    Returns per weekday totals of given user.
+    """
+    return get_arrays(data).weekday_totals(user_id)
+
+
+def organisation_totals(data):
+    """
+    Returns sums of intervals of all users for every weekday.
+    """
+    return get_arrays(data).organisation_totals()
@@ -8,7 +8,6 @@ from functools import partial
 
 import paste.script.command
 import werkzeug.script
-import urllib
 
 etc = partial(os.path.join, 'parts', 'etc')
 
@@ -32,6 +31,10 @@ def make_app(global_conf={}, config=DEPLOY_CFG, debug=False):
     from presence_analyzer import app
     app.config.from_pyfile(abspath(config))
     app.debug = debug
+    from presence_analyzer.utils import start_pool, warm_up
+    start_pool()  # before any thread is started
+    if app.config.get('WARM_UP'):
+        warm_up()
     return app
 
 
@@ -112,9 +115,25 @@ def run():
         """Stop the application."""
         _serve('stop', dry_run=dry_run)
 
+    # bin/flask-ctl warmup
+    def action_warmup():
+        """Load data caches and print how long every stage took.
+
+        With DATA_SNAPSHOT enabled it also writes the binary snapshot, so
+        the server started afterwards does not parse DATA_CSV.
+        """
+        from presence_analyzer import app
+        from presence_analyzer.utils import start_pool, warm_up
+        app.config.from_pyfile(abspath(DEPLOY_CFG))
+        start_pool()
+        for stage, seconds in warm_up():
+            print '{0}: {1:.3f} s'.format(stage, seconds)
+
     werkzeug.script.run()
 
 
 def update_xml_web():
-    app = make_app()
-    urllib.urlretrieve(app.config['DATA_XML_WEB'], app.config['DATA_XML'])
+    from presence_analyzer import app
+    from presence_analyzer.utils import update_xml
+    app.config.from_pyfile(abspath(DEPLOY_CFG))
+    update_xml(app.config['DATA_XML_WEB'], app.config['DATA_XML'])
@@ -4,13 +4,24 @@ Presence analyzer unit tests.
 """
 from __future__ import unicode_literals
 
+import os
 import os.path
 import json
+import gzip
+import hashlib
+import pstats
 import datetime
+import pickle
+import shutil
+import tempfile
+import threading
 import unittest
 import time
+import urllib2
+from io import BytesIO
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
 
-from presence_analyzer import main, utils
+from presence_analyzer import main, utils, helpers, metrics, numpy_engine
 
 
 TEST_DATA_CSV = os.path.join(
@@ -104,6 +115,296 @@ class PresenceAnalyzerViewsTestCase(unittest.TestCase):
             }
         )
 
+    def test_conditional_get(self):
+        """
+        Test conditional requests to JSON API.
+        """
+        resp = self.client.get('/api/v1/presence_weekday/10')
+        self.assertEqual(resp.status_code, 200)
+        etag = resp.headers['ETag']
+        last_modified = resp.headers['Last-Modified']
+        self.assertIn('no-cache', resp.headers['Cache-Control'])
+
+        resp = self.client.get(
+            '/api/v1/presence_weekday/10',
+            headers={'If-None-Match': etag}
+        )
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, b'')
+        self.assertEqual(resp.headers['ETag'], etag)
+
+        resp = self.client.get(
+            '/api/v1/presence_weekday/11',
+            headers={'If-None-Match': etag}
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp.headers['ETag'], etag)
+
+        resp = self.client.get(
+            '/api/v1/presence_weekday/10',
+            headers={'If-Modified-Since': last_modified}
+        )
+        self.assertEqual(resp.status_code, 304)
+
+        resp = self.client.get(
+            '/api/v1/presence_weekday/10',
+            headers={'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'}
+        )
+        self.assertEqual(resp.status_code, 200)
+
+        resp = self.client.get(
+            '/api/v1/presence_weekday/10',
+            headers={'If-None-Match': '*'}
+        )
+        self.assertEqual(resp.status_code, 304)
+
+        resp = self.client.get(
+            '/api/v1/presence_weekday/12',
+            headers={'If-None-Match': '*'}
+        )
+        self.assertEqual(resp.status_code, 404)
+
+        # requests rejected by the view are never 'not modified'
+        for url, status in (
+                ('/api/v1/mean_time_weekday/99999', 404),
+                ('/api/v2/weekly/424242', 404),
+                ('/api/v2/stats?user_id=abc', 400),
+                ('/api/v1/mean_time_weekday/10?from=bad', 400),
+        ):
+            resp = self.client.get(
+                url, headers={'If-Modified-Since': last_modified}
+            )
+            self.assertEqual(resp.status_code, status, url)
+
+    def test_missing_users_xml(self):
+        """
+        Test JSON API not using users works without users XML.
+        """
+        main.app.config.update({'DATA_XML': TEST_DATA_XML + '.missing'})
+        try:
+            resp = self.client.get('/api/v1/presence_weekday/10')
+            self.assertEqual(resp.status_code, 200)
+            resp = self.client.get('/api/v2/users')
+            self.assertEqual(resp.status_code, 500)
+            resp = self.client.get(
+                '/api/v2/users',
+                headers={'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'}
+            )
+            self.assertEqual(resp.status_code, 500)
+        finally:
+            main.app.config.update({'DATA_XML': TEST_DATA_XML})
+
+    def test_response_cache(self):
+        """
+        Test serialized responses cached until data changes.
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'data.csv')
+            shutil.copy(TEST_DATA_CSV, path)
+            main.app.config.update({'DATA_CSV': path})
+            utils.CACHE = {}
+            stats = utils.RESPONSES['stats']
+            hits = stats['hits']
+
+            resp = self.client.get('/api/v1/presence_weekday/10')
+            self.assertEqual(
+                resp.data,
+                b'[["Weekday","Presence (s)"],["Mon",0],["Tue",30047],'
+                b'["Wed",24465],["Thu",23705],["Fri",0],["Sat",0],["Sun",0]]'
+            )
+            self.assertEqual(stats['hits'], hits)
+            self.assertEqual(
+                self.client.get('/api/v1/presence_weekday/10').data,
+                resp.data
+            )
+            self.assertEqual(stats['hits'], hits + 1)
+            etag = resp.headers['ETag'].strip('"')
+            self.assertEqual(utils.RESPONSES['bodies'][etag], resp.data)
+
+            # slow request of obsolete data does not replace cached ones
+            utils.cache_response('obsolete', 'stale', b'[]')
+            self.assertIn(etag, utils.RESPONSES['bodies'])
+            self.assertNotIn('stale', utils.RESPONSES['bodies'])
+
+            with open(path, 'a') as csvfile:
+                csvfile.write('\n10,2013-09-09,09:00:00,17:00:00\n')
+            utils.CACHE = {}
+            resp = self.client.get('/api/v1/presence_weekday/10')
+            self.assertIn(b'["Mon",28800]', resp.data)
+            self.assertEqual(stats['hits'], hits + 1)
+            self.assertNotIn(etag, utils.RESPONSES['bodies'])
+
+            main.app.config.update({'JSON_CACHE_SIZE': 1})
+            evictions = stats['evictions']
+            self.client.get('/api/v1/presence_weekday/11')
+            self.assertEqual(stats['evictions'], evictions + 1)
+            self.assertEqual(len(utils.RESPONSES['bodies']), 1)
+        finally:
+            main.app.config.pop('JSON_CACHE_SIZE', None)
+            utils.CACHE = {}
+            shutil.rmtree(directory)
+
+    def test_gzip(self):
+        """
+        Test responses compressed for clients accepting gzip.
+        """
+        gzip_headers = {'Accept-Encoding': 'gzip, deflate'}
+        plain = self.client.get('/api/v1/mean_time_start_end/11')
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertNotIn('Vary', plain.headers)
+
+        main.app.config.update({'GZIP_MIN_SIZE': 100})
+        try:
+            resp = self.client.get(
+                '/api/v1/mean_time_start_end/11', headers=gzip_headers
+            )
+            self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(resp.headers['Vary'], 'Accept-Encoding')
+            self.assertEqual(
+                gzip.GzipFile(fileobj=BytesIO(resp.data)).read(), plain.data
+            )
+            etag = resp.headers['ETag']
+            self.assertTrue(etag.endswith('-gzip"'))
+            again = self.client.get(
+                '/api/v1/mean_time_start_end/11', headers=gzip_headers
+            )
+            self.assertEqual(again.data, resp.data)
+
+            resp = self.client.get(
+                '/api/v1/mean_time_start_end/11',
+                headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag}
+            )
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.headers['ETag'], etag)
+
+            resp = self.client.get(
+                '/api/v1/mean_time_start_end/11',
+                headers={'Accept-Encoding': 'gzip;q=0'}
+            )
+            self.assertNotIn('Content-Encoding', resp.headers)
+            self.assertEqual(resp.headers['Vary'], 'Accept-Encoding')
+
+            resp = self.client.get('/presence_weekday', headers=gzip_headers)
+            self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+            self.assertIn(
+                b'<html', gzip.GzipFile(fileobj=BytesIO(resp.data)).read()
+            )
+        finally:
+            main.app.config.pop('GZIP_MIN_SIZE')
+
+    def test_static_gzip(self):
+        """
+        Test static files precompressed once.
+        """
+        static = utils.get_static()
+        self.assertIs(utils.get_static(), static)
+        self.assertIn('js/jquery.min.js', static['gzipped'])
+        self.assertIn('css/normalize.css', static['gzipped'])
+        self.assertNotIn('img/loading.gif', static['gzipped'])
+
+        path = os.path.join(main.app.static_folder, 'js', 'jquery.min.js')
+        with open(path, 'rb') as static_file:
+            content = static_file.read()
+        resp = self.client.get(
+            '/static/js/jquery.min.js', headers={'Accept-Encoding': 'gzip'}
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(resp.headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(resp.data, static['gzipped']['js/jquery.min.js'])
+        self.assertEqual(
+            gzip.GzipFile(fileobj=BytesIO(resp.data)).read(), content
+        )
+        resp = self.client.get(
+            '/static/js/jquery.min.js',
+            headers={
+                'Accept-Encoding': 'gzip',
+                'If-None-Match': resp.headers['ETag'],
+            }
+        )
+        self.assertEqual(resp.status_code, 304)
+
+        resp = self.client.get('/static/js/jquery.min.js')
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual(resp.headers['Vary'], 'Accept-Encoding')
+        resp.direct_passthrough = False
+        self.assertEqual(resp.data, content)
+
+        resp = self.client.get(
+            '/static/img/loading.gif', headers={'Accept-Encoding': 'gzip'}
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn('Content-Encoding', resp.headers)
+        resp.close()
+
+        # debug mode sends files as they are on disk now
+        self.addCleanup(setattr, main.app, 'debug', False)
+        main.app.debug = True
+        resp = self.client.get(
+            '/static/js/jquery.min.js', headers={'Accept-Encoding': 'gzip'}
+        )
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertNotEqual(resp.headers['ETag'], static['etags'].get(
+            'js/jquery.min.js'
+        ))
+        resp.direct_passthrough = False
+        self.assertEqual(resp.data, content)
+
+    def test_static_url(self):
+        """
+        Test fingerprinted static files cached for a year.
+        """
+        static = utils.get_static()
+        path = os.path.join(main.app.static_folder, 'js', 'weekday.js')
+        with open(path, 'rb') as static_file:
+            content = static_file.read()
+        url = '/static/js/weekday.{0}.js'.format(
+            hashlib.sha1(content).hexdigest()[:12]
+        )
+        with main.app.test_request_context():
+            self.assertEqual(helpers.static_url('js/weekday.js'), url)
+            self.assertEqual(
+                helpers.static_url('js/unknown.js'), '/static/js/unknown.js'
+            )
+
+        resp = self.client.get('/presence_weekday')
+        self.assertIn(url.encode('utf-8'), resp.data)
+        self.assertIn(b'/static/img/loading.', resp.data)
+        self.assertNotIn(b'/static/js/jquery.min.js', resp.data)
+
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            resp.headers['Cache-Control'],
+            'public, max-age=31536000, immutable'
+        )
+        resp.direct_passthrough = False
+        self.assertEqual(resp.data, content)
+
+        resp = self.client.get(
+            '/static/' + static['fingerprints']['js/jquery.min.js'],
+            headers={'Accept-Encoding': 'gzip'}
+        )
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertIn('immutable', resp.headers['Cache-Control'])
+
+        resp = self.client.get('/static/js/weekday.js')
+        self.assertNotIn('immutable', resp.headers.get('Cache-Control', ''))
+        resp.close()
+        resp = self.client.get('/static/js/weekday.000000000000.js')
+        self.assertEqual(resp.status_code, 404)
+
+        main.app.debug = True
+        try:
+            with main.app.test_request_context():
+                self.assertEqual(
+                    helpers.static_url('js/weekday.js'),
+                    '/static/js/weekday.js'
+                )
+        finally:
+            main.app.debug = False
+
     def test_time_weekday(self):
         """
         Test weekday time view.
@@ -174,6 +475,220 @@ class PresenceAnalyzerViewsTestCase(unittest.TestCase):
             ]
         )
 
+    def test_stats_view(self):
+        """
+        Test statistics of many users at once.
+        """
+        resp = self.client.get(
+            '/api/v2/stats?user_id=10,12&user_id=11'
+            '&stat=presence_weekday,total_hour'
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content_type, 'application/json')
+        data = json.loads(resp.data)
+        self.assertEqual(data['missing'], [12])
+        self.assertItemsEqual(data['users'].keys(), ['10', '11'])
+        self.assertItemsEqual(
+            data['users']['10'].keys(),
+            ['presence_weekday', 'total_hour', 'user']
+        )
+        self.assertIsNone(data['users']['10']['user'])
+        self.assertEqual(
+            data['users']['10']['presence_weekday'],
+            json.loads(self.client.get('/api/v1/presence_weekday/10').data)
+        )
+        self.assertEqual(
+            data['users']['11']['total_hour'],
+            json.loads(self.client.get('/api/v2/total_hour/11').data)
+        )
+
+        resp = self.client.get('/api/v2/stats?user_id=11')
+        data = json.loads(resp.data)
+        self.assertEqual(
+            data['users']['11']['mean_time_start_end'],
+            json.loads(self.client.get('/api/v1/mean_time_start_end/11').data)
+        )
+        self.assertEqual(
+            data['users']['11']['mean_time_weekday'],
+            json.loads(self.client.get('/api/v1/mean_time_weekday/11').data)
+        )
+
+        resp = self.client.get('/api/v2/stats?user_id=x')
+        self.assertEqual(resp.status_code, 400)
+        resp = self.client.get('/api/v2/stats?user_id=10&stat=unknown')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_export_view(self):
+        """
+        Test streaming export of presence data.
+        """
+        resp = self.client.get('/api/v2/export')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content_type, 'application/x-ndjson')
+        lines = [json.loads(line) for line in resp.data.splitlines()]
+        self.assertEqual(len(lines), 9)
+        self.assertEqual(
+            lines[0],
+            {
+                'user_id': 10,
+                'date': '2013-09-10',
+                'start': '09:39:05',
+                'end': '17:59:52',
+            }
+        )
+
+        resp = self.client.get(
+            '/api/v2/export?format=csv&user_id=11,12'
+            '&from=2013-09-10&to=2013-09-12'
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'text/csv')
+        self.assertEqual(
+            resp.data.splitlines(),
+            [
+                'user_id,date,start,end',
+                '11,2013-09-10,09:19:50,13:55:54',
+                '11,2013-09-11,09:13:26,16:15:27',
+                '11,2013-09-12,10:18:36,16:41:25',
+            ]
+        )
+
+        resp = self.client.get('/api/v2/export?format=xml')
+        self.assertEqual(resp.status_code, 400)
+        resp = self.client.get('/api/v2/export?from=yesterday')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_date_range(self):
+        """
+        Test statistics limited by date range.
+        """
+        resp = self.client.get(
+            '/api/v1/presence_weekday/11?from=2013-09-10&to=2013-09-12'
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            json.loads(resp.data),
+            [
+                ['Weekday', 'Presence (s)'],
+                ['Mon', 0],
+                ['Tue', 16564],
+                ['Wed', 25321],
+                ['Thu', 22969],
+                ['Fri', 0],
+                ['Sat', 0],
+                ['Sun', 0]
+            ]
+        )
+
+        resp = self.client.get('/api/v1/mean_time_weekday/11?from=2013-09-12')
+        self.assertEqual(
+            json.loads(resp.data)[3:5],
+            [['Thu', 22969.0], ['Fri', 6426.0]]
+        )
+
+        resp = self.client.get('/api/v1/mean_time_start_end/11?to=2013-09-05')
+        self.assertEqual(
+            json.loads(resp.data)[:4],
+            [['Mon', 0, 0], ['Tue', 0, 0], ['Wed', 0, 0],
+             ['Thu', 34088.0, 57087.0]]
+        )
+
+        resp = self.client.get('/api/v2/total_hour/10?from=2013-09-11')
+        self.assertEqual(
+            json.loads(resp.data)[1:6],
+            [
+                ['Mon', 0.00, 0.00],
+                ['Tue', 0.00, 0.00],
+                ['Wed', 6.80, 13.83],
+                ['Thu', 6.58, 12.96],
+                ['Fri', 0.00, 1.78],
+            ]
+        )
+
+        resp = self.client.get('/api/v2/total_hour/10?from=2013-13-01')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_rollup_views(self):
+        """
+        Test hours by week and month.
+        """
+        resp = self.client.get('/api/v2/weekly/10')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content_type, 'application/json')
+        self.assertEqual(
+            json.loads(resp.data),
+            [
+                ['Week', 'User hours', 'User mean hours', 'Total hours',
+                 'Mean hours'],
+                ['2013-W37', 21.73, 7.24, 48.23, 6.03],
+            ]
+        )
+
+        resp = self.client.get('/api/v2/weekly')
+        self.assertEqual(
+            json.loads(resp.data),
+            [
+                ['Week', 'Total hours', 'Mean hours'],
+                ['2013-W36', 6.39, 6.39],
+                ['2013-W37', 48.23, 6.03],
+            ]
+        )
+
+        resp = self.client.get('/api/v2/monthly/11')
+        self.assertEqual(
+            json.loads(resp.data),
+            [
+                ['Month', 'User hours', 'User mean hours', 'Total hours',
+                 'Mean hours'],
+                ['2013-09', 32.89, 5.48, 54.62, 6.07],
+            ]
+        )
+
+        resp = self.client.get('/api/v2/monthly/12')
+        self.assertEqual(resp.status_code, 404)
+
+    def test_metrics_view(self):
+        """
+        Test metrics of requests, caches and data loads.
+        """
+        metrics.SAMPLES.clear()
+        utils.LOADED.clear()
+        utils.CACHE = {}
+        self.client.get('/api/v1/mean_time_weekday/10')
+        self.client.get('/api/v1/mean_time_weekday/12')
+        resp = self.client.get('/metrics')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'text/plain')
+        lines = resp.data.splitlines()
+        self.assertIn('# TYPE presence_requests_total counter', lines)
+        self.assertIn(
+            'presence_requests_total{route="/api/v1/mean_time_weekday/'
+            '<int:user_id>",status="200"} 1',
+            lines
+        )
+        self.assertIn(
+            'presence_requests_total{route="/api/v1/mean_time_weekday/'
+            '<int:user_id>",status="404"} 1',
+            lines
+        )
+        self.assertIn(
+            'presence_request_duration_seconds_count{route="/api/v1/'
+            'mean_time_weekday/<int:user_id>"} 2',
+            lines
+        )
+        self.assertIn(
+            'presence_data_load_duration_seconds_bucket'
+            '{mode="full",le="+Inf"} 1',
+            lines
+        )
+        self.assertIn('presence_data_rows 9', lines)
+        self.assertIn('presence_data_users 2', lines)
+        self.assertTrue(any(
+            line.startswith('presence_cache_hits_total{function="get_data"}')
+            for line in lines
+        ))
+        utils.CACHE = {}
+
     def test_viewer(self):
         """
         Test viewer templates.
@@ -190,6 +705,46 @@ class PresenceAnalyzerViewsTestCase(unittest.TestCase):
         resp = self.client.get('/newsie')
         self.assertEqual(resp.status_code, 404)
 
+    def test_profile(self):
+        """
+        Test profiling of chosen requests.
+        """
+        root = tempfile.mkdtemp()
+        directory = os.path.join(root, 'profile')  # created when needed
+        try:
+            main.app.config.update({'PROFILE_DIR': directory})
+            resp = self.client.get('/presence_weekday?profile')
+            self.assertNotIn('X-Profile', resp.headers)
+
+            main.app.config.update({'PROFILE': True, 'PROFILE_SAMPLE': 0})
+            resp = self.client.get('/presence_weekday')
+            self.assertNotIn('X-Profile', resp.headers)
+            self.assertFalse(os.path.exists(directory))
+
+            resp = self.client.get('/presence_weekday?profile')
+            self.assertTrue(
+                resp.headers['X-Profile'].endswith('-viewer.pstats')
+            )
+            stats = pstats.Stats(
+                os.path.join(directory, resp.headers['X-Profile'])
+            )
+            self.assertTrue(any(
+                function[2] == 'viewer' for function in stats.stats
+            ))
+
+            resp = self.client.get(
+                '/api/v1/users', headers={'X-Profile': '1'}
+            )
+            self.assertIn('X-Profile', resp.headers)
+
+            main.app.config.update({'PROFILE_SAMPLE': 1})
+            resp = self.client.get('/api/v1/users')
+            self.assertIn('X-Profile', resp.headers)
+            self.assertEqual(len(os.listdir(directory)), 3)
+        finally:
+            main.app.config.update({'PROFILE': False, 'PROFILE_SAMPLE': 0})
+            shutil.rmtree(root)
+
 
 class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
     """
@@ -273,12 +828,67 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
         self.assertEqual(time_before, time_after)
 
         time.sleep(1)
-        utils.get_data()
-        time_after = utils.CACHE['get_data']['time']
+        utils.get_data()  # obsolete data is reloaded in background
+        for __ in range(100):
+            time_after = utils.CACHE['get_data']['time']
+            if time_before != time_after:
+                break
+            time.sleep(0.01)
         self.assertNotEqual(time_before, time_after)
 
         utils.CACHE = {}
 
+    def test_get_data_reload(self):
+        """
+        Test readers are not blocked while data is reloaded.
+        """
+        load_data = utils.load_data
+        loading = threading.Event()
+        release = threading.Event()
+
+        def slow_load_data(path):
+            """
+            Loads data after release.
+            """
+            loading.set()
+            release.wait(5)
+            return load_data(path)
+
+        old = utils.get_data()
+        utils.load_data = slow_load_data
+        try:
+            utils.CACHE['get_data']['time'] = 0
+            self.assertIs(utils.get_data(), old)
+            self.assertTrue(loading.wait(5))
+
+            results = []
+            readers = [
+                threading.Thread(
+                    target=lambda: results.append(utils.get_data())
+                )
+                for __ in range(10)
+            ]
+            for reader in readers:
+                reader.start()
+            for reader in readers:
+                reader.join(1)
+            self.assertFalse(any(reader.is_alive() for reader in readers))
+            self.assertEqual(len(results), 10)
+            self.assertTrue(all(result is old for result in results))
+        finally:
+            release.set()
+            utils.load_data = load_data
+
+        for __ in range(100):
+            if utils.CACHE['get_data']['time']:
+                break
+            time.sleep(0.01)
+        new = utils.get_data()
+        self.assertIsNot(new, old)
+        self.assertEqual(new.generation, old.generation)
+        self.assertGreater(utils.get_data.stats['stale'], 0)
+        utils.CACHE = {}
+
     def test_is_obsolete(self):
         """
         Test checking obsolete time.
@@ -292,6 +902,112 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
         self.assertFalse(utils.is_obsolete({'time': time.time()}, 1))
         self.assertTrue(utils.is_obsolete({'time': time.time()}, -5))
 
+    def test_memoize_arguments(self):
+        """
+        Test caching results by arguments with LRU eviction.
+        """
+        calls = []
+
+        @utils.memoize(50000, maxsize=2)
+        def square(number):
+            """
+            Squares number counting calls.
+            """
+            calls.append(number)
+            return number * number
+
+        self.assertEqual(square(2), 4)
+        self.assertEqual(square(3), 9)
+        self.assertEqual(square(2), 4)
+        self.assertEqual(calls, [2, 3])
+        self.assertEqual(square.stats['hits'], 1)
+        self.assertEqual(square.stats['misses'], 2)
+
+        square(4)  # evicts 3, least recently used
+        self.assertNotIn(('square', 3), utils.CACHE)
+        self.assertIn(('square', 2), utils.CACHE)
+        square(3)
+        self.assertEqual(calls, [2, 3, 4, 3])
+        self.assertEqual(square.stats['evictions'], 2)
+
+        utils.CACHE[('square', 3)]['time'] = 0
+        square(3)
+        self.assertEqual(calls, [2, 3, 4, 3, 3])
+        self.assertEqual(square.computing, {})
+        utils.CACHE = {}
+
+    def test_memoize_computing(self):
+        """
+        Test key is computed once while evicted and its lock is dropped.
+        """
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+
+        @utils.memoize(50000, maxsize=1)
+        def slow(number):
+            """
+            Returns number, waits for release when recomputing 1.
+            """
+            calls.append(number)
+            if number < 0:
+                raise ValueError(number)
+            if number == 1 and calls.count(1) > 1:
+                started.set()
+                release.wait(5)
+            return number
+
+        self.assertEqual(slow(1), 1)
+        utils.CACHE[('slow', 1)]['time'] = 0
+        results = []
+        first = threading.Thread(target=lambda: results.append(slow(1)))
+        first.start()
+        self.assertTrue(started.wait(5))
+        slow(2)  # evicts 1 while it is computed
+        second = threading.Thread(target=lambda: results.append(slow(1)))
+        second.start()
+        release.set()
+        first.join(5)
+        second.join(5)
+        self.assertEqual(results, [1, 1])
+        self.assertEqual(calls, [1, 1, 2])
+
+        for __ in range(3):
+            with self.assertRaises(ValueError):
+                slow(-1)
+        self.assertEqual(slow.computing, {})
+        utils.CACHE = {}
+
+    def test_memoize_stale(self):
+        """
+        Test stale result is returned while refreshing in background.
+        """
+        release = threading.Event()
+        values = iter([1, 2])
+
+        @utils.memoize(50000, stale=True)
+        def counter():
+            """
+            Returns next value, the second one after release.
+            """
+            value = next(values)
+            if value > 1:
+                release.wait(5)
+            return value
+
+        self.assertEqual(counter(), 1)
+        utils.CACHE['counter']['time'] = 0
+        self.assertEqual(counter(), 1)
+        self.assertEqual(counter(), 1)  # refresh runs only once
+        self.assertEqual(counter.stats['stale'], 2)
+        release.set()
+        for __ in range(100):
+            if utils.CACHE['counter']['value'] == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(counter(), 2)
+        utils.CACHE = {}
+
     def test_parse_xml(self):
         """
         Test parsing of XML file.
@@ -301,6 +1017,76 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
         self.assertIsInstance(data, dict)
         self.assertItemsEqual(data[141].keys(), ['name', 'avatar'])
         self.assertEqual(data[176]['name'], 'Adrian K.')
+        self.assertEqual(
+            data[141]['avatar'],
+            'https://intranet.stxnext.pl:443/api/images/users/141'
+        )
+
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'users.xml')
+            with open(path, 'w') as xml_file:
+                xml_file.write(
+                    b'<intranet><users>'
+                    b'<user id="1"><avatar>/1</avatar><name>A</name></user>'
+                    b'<user id="2"><name>B</name><avatar>/2</avatar></user>'
+                    b'</users><server><protocol>http</protocol>'
+                    b'<host>h</host><port>80</port></server></intranet>'
+                )
+            main.app.config.update({'DATA_XML': path})
+            self.assertEqual(
+                utils.parse_xml(),
+                {
+                    1: {'name': 'A', 'avatar': 'http://h:80/1'},
+                    2: {'name': 'B', 'avatar': 'http://h:80/2'},
+                }
+            )
+        finally:
+            main.app.config.update({'DATA_XML': TEST_DATA_XML})
+            shutil.rmtree(directory)
+
+    def test_get_users(self):
+        """
+        Test users directory is parsed again only when XML file changes.
+        """
+        handle, path = tempfile.mkstemp(suffix='.xml')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        shutil.copyfile(TEST_DATA_XML, path)
+        main.app.config.update({'DATA_XML': path})
+
+        directory = utils.get_users()
+        self.assertIs(utils.get_users(), directory)
+        self.assertItemsEqual(directory['users'].keys(), [176, 141])
+        self.assertEqual(
+            [user['user_id'] for user in directory['sorted']],
+            [141, 176]
+        )
+        self.assertEqual(json.loads(directory['json']), directory['sorted'])
+
+        with open(path, 'r') as xmlfile:
+            content = xmlfile.read()
+        with open(path, 'w') as xmlfile:
+            xmlfile.write(content.replace('Adam P.', 'Zenon P.'))
+        os.utime(path, (0, 0))
+        reloaded = utils.get_users()
+        self.assertIsNot(reloaded, directory)
+        self.assertEqual(
+            [user['user_id'] for user in reloaded['sorted']],
+            [176, 141]
+        )
+
+        # XML change is not held up by CSV load holding LOCK
+        os.utime(path, (1, 1))
+        results = []
+        with utils.LOCK:
+            thread = threading.Thread(
+                target=lambda: results.append(utils.get_users())
+            )
+            thread.start()
+            thread.join(5)
+        self.assertEqual(len(results), 1)
+        self.assertIsNot(results[0], reloaded)
 
     def test_group_by_weekday(self):
         """
@@ -393,6 +1179,8 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
         self.assertEqual(utils.mean([]), 0)
         self.assertEqual(utils.mean([-1]), -1)
         self.assertEqual(utils.mean([0]), 0)
+        self.assertAlmostEqual(utils.mean_of(10, 4), 2.5)
+        self.assertEqual(utils.mean_of(0, 0), 0)
 
     def test_group_by_start_end(self):
         """
@@ -406,13 +1194,659 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
                 0: [[33134], [57257]],
                 1: [[33590], [50154]],
                 2: [[33206], [58527]],
-                3: [[37116, 34088], [60085, 57087]],
+                3: [[34088, 37116], [57087, 60085]],
                 4: [[47816], [54242]],
                 5: [[], []],
                 6: [[], []],
             }
         )
 
+    def test_load_data_incremental(self):
+        """
+        Test parsing only rows appended since the last load.
+        """
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        shutil.copyfile(TEST_DATA_CSV, path)
+        sample_date = datetime.date(2013, 9, 13)
+
+        data = utils.load_data(path)
+        self.assertItemsEqual(data.keys(), [10, 11])
+        self.assertEqual(
+            data.totals,
+            (24123, 46611, 49786, 69673, 6426, 0, 0)
+        )
+        self.assertIs(utils.load_data(path).totals, data.totals)
+        self.assertEqual(utils.load_data(path).generation, data.generation)
+        # unterminated last line will be read again
+        self.assertEqual(
+            utils.LOADED['offset'],
+            os.path.getsize(path) - len('11,2013-09-13,13:16:56,15:04:02')
+        )
+
+        with open(path, 'a') as csvfile:
+            csvfile.write('\n10,2013-09-13,08:00:00,16:00:00\n12,2013-09-13,')
+        appended = utils.load_data(path)
+        self.assertItemsEqual(appended.keys(), [10, 11])
+        self.assertIsNot(appended[10], data[10])
+        self.assertNotEqual(appended.generation, data.generation)
+        self.assertEqual(
+            appended.totals,
+            (24123, 46611, 49786, 69673, 6426 + 28800, 0, 0)
+        )
+        self.assertEqual(
+            appended.rollups,
+            utils.organisation_rollups(
+                utils.organisation_days(appended, {}, None, None)
+            )
+        )
+        self.assertEqual(
+            utils.LOADED['days'],
+            utils.organisation_days(appended, {}, None, None)
+        )
+        first = datetime.date(2013, 9, 10).toordinal()
+        last = sample_date.toordinal()
+        expected = [0] * 7
+        for user in appended.values():
+            for day, totals in enumerate(user.weekday_totals(first, last)):
+                expected[day] += totals[1]
+        self.assertEqual(
+            utils.organisation_totals(appended, first, last),
+            tuple(expected)
+        )
+        self.assertEqual(
+            utils.organisation_totals(appended, last + 1, last),
+            (0, 0, 0, 0, 0, 0, 0)
+        )
+        self.assertNotIn(sample_date, data[10])
+        self.assertEqual(
+            appended[10][sample_date]['start'],
+            datetime.time(8, 0, 0)
+        )
+
+        with open(path, 'a') as csvfile:
+            csvfile.write('08:00:00,09:00:00\n')
+        completed = utils.load_data(path)
+        self.assertItemsEqual(completed.keys(), [10, 11, 12])
+        self.assertIs(completed[10], appended[10])
+        self.assertIs(completed[11], appended[11])
+
+        # replaced day of user 11 is subtracted from organisation days
+        with open(path, 'a') as csvfile:
+            csvfile.write('11,2013-09-10,10:00:00,11:00:00\n')
+        replaced = utils.load_data(path)
+        self.assertEqual(
+            utils.LOADED['days'],
+            utils.organisation_days(replaced, {}, None, None)
+        )
+        self.assertEqual(
+            utils.organisation_totals(replaced, first, last)[1],
+            replaced.totals[1]
+        )
+
+        shutil.copyfile(TEST_DATA_CSV, path)
+        reloaded = utils.load_data(path)
+        self.assertItemsEqual(reloaded.keys(), [10, 11])
+        self.assertNotIn(sample_date, reloaded[10])
+        self.assertIsNot(reloaded[11], data[11])
+
+    def test_snapshot(self):
+        """
+        Test loading parsed data from binary snapshot.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'data.csv')
+        shutil.copyfile(TEST_DATA_CSV, path)
+        main.app.config.update({'DATA_SNAPSHOT': True})
+        self.addCleanup(main.app.config.update, {'DATA_SNAPSHOT': False})
+
+        data = utils.load_data(path)
+        offset = utils.LOADED['offset']
+        self.assertTrue(os.path.exists(utils.snapshot_path(path)))
+
+        snapshot, snapshot_offset, days, size = utils.read_snapshot(
+            path, utils.file_identity(path)
+        )
+        self.assertEqual(snapshot_offset, offset)
+        self.assertEqual(days, utils.LOADED['days'])
+        self.assertEqual(size, os.path.getsize(path))
+        column = snapshot[10].days
+        self.assertIsInstance(column, utils.MappedColumn)
+        self.assertEqual(list(column), list(data[10].days))
+        self.assertEqual(column[-1], data[10].days[-1])
+        self.assertEqual(column[1:], data[10].days[1:])
+        self.assertEqual(column[::-1], data[10].days[::-1])
+        self.assertEqual(column.tostring(), data[10].days.tostring())
+        with self.assertRaises(IndexError):
+            column[len(column)]
+        self.assertItemsEqual(snapshot.keys(), data.keys())
+        for user_id, user in data.items():
+            self.assertEqual(
+                list(snapshot[user_id].rows()),
+                list(user.rows())
+            )
+            self.assertEqual(
+                snapshot[user_id].weekday_totals(),
+                user.weekday_totals()
+            )
+            self.assertEqual(
+                snapshot[user_id].rollup('weeks'),
+                user.rollup('weeks')
+            )
+
+        parsed = []
+        read_presence = utils.read_presence
+
+        def parse_tail(lines, *args):
+            """
+            Records parsed lines.
+            """
+            lines = list(lines)
+            parsed.extend(lines)
+            return read_presence(lines, *args)
+        self.addCleanup(setattr, utils, 'read_presence', read_presence)
+        utils.read_presence = parse_tail
+        utils.LOADED.clear()
+        loaded = utils.load_data(path)
+        # unterminated last line is parsed again
+        self.assertEqual(parsed, ['11,2013-09-13,13:16:56,15:04:02'])
+        self.assertEqual(loaded.totals, data.totals)
+        self.assertEqual(loaded.rollups, data.rollups)
+        self.assertIsInstance(loaded[10].days, utils.MappedColumn)
+
+        # only rows appended since the snapshot are parsed
+        del parsed[:]
+        with open(path, 'a') as csvfile:
+            csvfile.write('\n10,2013-09-16,08:00:00,16:00:00\n')
+        utils.LOADED.clear()
+        appended = utils.load_data(path)
+        self.assertEqual(parsed, [
+            '11,2013-09-13,13:16:56,15:04:02\n',
+            '10,2013-09-16,08:00:00,16:00:00\n',
+        ])
+        self.assertEqual(appended.totals[0], data.totals[0] + 28800)
+        self.assertEqual(
+            utils.LOADED['days'],
+            utils.organisation_days(appended, {}, None, None)
+        )
+        self.assertNotIsInstance(appended[10].days, utils.MappedColumn)
+        self.assertEqual(list(loaded[10].rows()), list(data[10].rows()))
+        identity = utils.file_identity(path)
+        self.assertEqual(utils.read_snapshot(path, identity)[3], identity[1])
+
+        # snapshot was rewritten with appended rows
+        del parsed[:]
+        utils.LOADED.clear()
+        reloaded = utils.load_data(path)
+        self.assertEqual(parsed, [])
+        self.assertEqual(reloaded.totals, appended.totals)
+        self.assertIsInstance(reloaded[10].days, utils.MappedColumn)
+
+        self.assertIsNone(utils.read_snapshot(path, identity[:2] + (0, )))
+        self.assertIsNone(utils.read_snapshot(path, (0, ) + identity[1:]))
+        self.assertIsNone(
+            utils.read_snapshot(path, (identity[0], 0, identity[2]))
+        )
+        # mapped snapshot is always replaced, never changed in place
+        with open(utils.snapshot_path(path), 'rb') as snapshot_file:
+            content = snapshot_file.read()
+        utils.write_atomically(utils.snapshot_path(path), content[:100])
+        self.assertIsNone(utils.read_snapshot(path, identity))
+
+    def test_read_presence_parallel(self):
+        """
+        Test parsing file in chunks by pool of processes.
+        """
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        with open(TEST_DATA_CSV, 'r') as csvfile:
+            content = csvfile.read()
+        with open(path, 'w') as csvfile:
+            csvfile.write(content.replace(
+                '11,2013-09-13',
+                '10,2013-09-10,01:00:00,02:00:00\n11,2013-09-13'
+            ))
+
+        ranges = utils.chunk_ranges(path, 3)
+        self.assertEqual(len(ranges), 3)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], os.path.getsize(path))
+        for (__, end), (start, __) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, start)
+
+        data, offset = utils.read_presence_parallel(path, 3)
+        state = {'offset': 0}
+        with open(path, 'rb') as csvfile:
+            expected = utils.read_presence(
+                utils._track_offset(csvfile, state), {}
+            )
+        self.assertEqual(offset, state['offset'])
+        self.assertItemsEqual(data.keys(), expected.keys())
+        for user_id, user in expected.items():
+            self.assertEqual(list(data[user_id].rows()), list(user.rows()))
+            self.assertEqual(
+                data[user_id].weekday_totals(),
+                user.weekday_totals()
+            )
+        self.assertEqual(
+            data[10][datetime.date(2013, 9, 10)]['start'],
+            datetime.time(1, 0, 0)
+        )
+
+        main.app.config.update({'DATA_LOAD_WORKERS': 2})
+        self.addCleanup(main.app.config.update, {'DATA_LOAD_WORKERS': 1})
+        self.addCleanup(setattr, utils, 'PARALLEL_MIN_SIZE', 1 << 20)
+        utils.PARALLEL_MIN_SIZE = 0
+        self.assertEqual(
+            list(utils.load_data(path)[11].rows()),
+            list(expected[11].rows())
+        )
+
+        # background threads never fork, they use pool started beforehand
+        pool_class = utils.Pool
+        forks = []
+        results = []
+
+        def reload_data():
+            utils.LOADED.clear()
+            results.append(list(utils.load_data(path)[11].rows()))
+
+        def fork(*args):
+            forks.append(args)
+            return pool_class(*args)
+
+        self.addCleanup(setattr, utils, 'Pool', pool_class)
+        self.addCleanup(utils.stop_pool)
+        utils.Pool = fork
+        thread = threading.Thread(target=reload_data)
+        thread.start()
+        thread.join()
+        self.assertEqual(forks, [])
+        self.assertIsNotNone(utils.start_pool())
+        self.assertIs(utils.start_pool(), utils.POOL['pool'])
+        thread = threading.Thread(target=reload_data)
+        thread.start()
+        thread.join()
+        self.assertEqual(forks, [(2,)])
+        self.assertEqual(results, [list(expected[11].rows())] * 2)
+
+    def test_rollups(self):
+        """
+        Test rollups by week and month kept up to date with changes.
+        """
+        user = utils.UserPresence()
+        monday = datetime.date(2013, 9, 30).toordinal()
+        user.append(monday, 0, 100)
+        user.append(monday + 1, 0, 200)  # October
+        user.append(monday + 7, 0, 300)
+        week = utils.week_of(monday)
+        september = utils.month_of(monday)
+        self.assertEqual(utils.week_label(week), '2013-W40')
+        self.assertEqual(utils.month_label(september), '2013-09')
+        self.assertEqual(
+            user.rollup('weeks'),
+            {week: [2, 300], week + 1: [1, 300]}
+        )
+        self.assertEqual(
+            user.rollup('months'),
+            {september: [1, 100], september + 1: [2, 500]}
+        )
+
+        user.append(monday, 50, 100)
+        self.assertEqual(user.rollup('weeks')[week], [2, 250])
+        self.assertEqual(user.copy().rollup('weeks')[week], [2, 250])
+
+        self.assertEqual(utils.UserPresence().rollup('months'), {})
+
+        data = {10: user}
+        days = utils.organisation_days(data, {}, None, None)
+        rollups = utils.organisation_rollups(days)
+        self.assertEqual(rollups['weeks'], user.rollup('weeks'))
+        self.assertEqual(rollups['months'], user.rollup('months'))
+        changed = user.copy()
+        changed.append(monday + 14, 0, 400)
+        days = utils.organisation_days(
+            {10: changed, 11: user}, data, days, {10, 11}
+        )
+        self.assertEqual(
+            utils.organisation_rollups(days)['weeks'],
+            {week: [4, 500], week + 1: [2, 600], week + 2: [1, 400]}
+        )
+
+    def test_metrics(self):
+        """
+        Test histograms and formatting of metrics.
+        """
+        metrics.SAMPLES.clear()
+        metrics.observe('presence_data_load_duration_seconds', 0.02, mode='a')
+        metrics.observe('presence_data_load_duration_seconds', 20, mode='a')
+        self.assertEqual(
+            metrics.format_sample(
+                'duration', (('mode', 'a'),),
+                metrics.SAMPLES[
+                    ('presence_data_load_duration_seconds', (('mode', 'a'),))
+                ]
+            )[2:4] + metrics.format_sample(
+                'duration', (('mode', 'a'),),
+                metrics.SAMPLES[
+                    ('presence_data_load_duration_seconds', (('mode', 'a'),))
+                ]
+            )[-3:],
+            [
+                'duration_bucket{mode="a",le="0.025"} 1',
+                'duration_bucket{mode="a",le="0.05"} 1',
+                'duration_bucket{mode="a",le="+Inf"} 2',
+                'duration_count{mode="a"} 2',
+                'duration_sum{mode="a"} 20.02',
+            ]
+        )
+        self.assertEqual(
+            metrics.format_labels((('route', 'a"b\\'),)),
+            '{route="a\\"b\\\\"}'
+        )
+        metrics.SAMPLES.clear()
+
+    def test_update_xml(self):
+        """
+        Test conditional and atomic download of users XML.
+        """
+        served = {'content': b'<intranet/>', 'etag': '"1"', 'status': 200}
+        received = []
+
+        class Handler(BaseHTTPRequestHandler):
+            """
+            Serves 'served' content, honoring If-None-Match.
+            """
+            def do_GET(self):  # pylint: disable=invalid-name
+                """
+                Sends content, 304 or error status.
+                """
+                received.append(dict(self.headers))
+                if self.headers.get('If-None-Match') == served['etag']:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(served['status'])
+                self.send_header('ETag', served['etag'])
+                self.send_header(
+                    'Last-Modified', 'Thu, 10 Oct 2013 08:00:00 GMT'
+                )
+                self.end_headers()
+                self.wfile.write(served['content'])
+
+            def log_message(self, *args):
+                """
+                Keeps test output clean.
+                """
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        url = 'http://127.0.0.1:{0}/users.xml'.format(server.server_port)
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'users.xml')
+        try:
+            self.assertTrue(utils.update_xml(url, path))
+            self.assertNotIn('if-none-match', received[-1])
+            with open(path) as xml_file:
+                self.assertEqual(xml_file.read(), b'<intranet/>')
+            identity = utils.file_identity(path)
+
+            self.assertFalse(utils.update_xml(url, path))
+            self.assertEqual(received[-1]['if-none-match'], '"1"')
+            self.assertEqual(
+                received[-1]['if-modified-since'],
+                'Thu, 10 Oct 2013 08:00:00 GMT'
+            )
+
+            served['etag'] = '"2"'  # the same content
+            self.assertFalse(utils.update_xml(url, path))
+            self.assertEqual(utils.file_identity(path), identity)
+            self.assertFalse(utils.update_xml(url, path))
+            self.assertEqual(received[-1]['if-none-match'], '"2"')
+
+            served.update({'content': b'<intranet></intranet>', 'etag': '3'})
+            self.assertTrue(utils.update_xml(url, path))
+            with open(path) as xml_file:
+                self.assertEqual(xml_file.read(), b'<intranet></intranet>')
+
+            served.update({'status': 500, 'etag': '4'})
+            with self.assertRaises(urllib2.HTTPError):
+                utils.update_xml(url, path)
+            with open(path) as xml_file:
+                self.assertEqual(xml_file.read(), b'<intranet></intranet>')
+            self.assertItemsEqual(
+                os.listdir(directory), ['users.xml', 'users.xml.meta']
+            )
+        finally:
+            server.shutdown()
+            server.server_close()
+            shutil.rmtree(directory)
+
+    def test_parse_row(self):
+        """
+        Test parsing of single CSV row.
+        """
+        sample_day = datetime.date(2013, 9, 10).toordinal()
+        self.assertEqual(
+            utils.parse_row(['10', '2013-09-10', '09:39:05', '17:59:52']),
+            (10, sample_day, 34745, 64792)
+        )
+        # non-conforming layouts accepted by strptime
+        self.assertEqual(
+            utils.parse_row(['10', '2013-9-10', '9:39:5', '17:59:52']),
+            (10, sample_day, 34745, 64792)
+        )
+        days = {}
+        utils.parse_row(['10', '2013-09-10', '09:39:05', '17:59:52'], days)
+        self.assertEqual(days, {'2013-09-10': sample_day})
+
+        for row in (
+                ['x', '2013-09-10', '09:39:05', '17:59:52'],
+                ['10', '2013-02-30', '09:39:05', '17:59:52'],
+                ['10', '2013-09-10', '24:00:00', '17:59:52'],
+                ['10', '2013-09-10', '09:60:05', '17:59:52'],
+                ['10', '2013-09-10', '09:39:05', '17:59:61'],
+                ['10', '2013-09-10', '09:39:05', '-7:59:52'],
+                ['10', '2013/09/10', '09:39:05', '17:59:52'],
+        ):
+            with self.assertRaises(ValueError):
+                utils.parse_row(row)
+
+    def test_user_presence(self):
+        """
+        Test columnar store of single user entries.
+        """
+        user = utils.UserPresence()
+        sample_date = datetime.date(2013, 9, 10)
+        user.append(sample_date.toordinal() + 1, 100, 200)
+        user.append(sample_date.toordinal(), 300, 400)
+        user.append(sample_date.toordinal() + 1, 500, 600)
+        self.assertEqual(len(user), 2)
+        self.assertEqual(
+            list(user),
+            [sample_date, sample_date + datetime.timedelta(days=1)]
+        )
+        self.assertEqual(
+            list(user.rows()),
+            [
+                (sample_date.toordinal(), 300, 400),
+                (sample_date.toordinal() + 1, 500, 600),
+            ]
+        )
+        self.assertIn(sample_date, user)
+        self.assertNotIn(datetime.date(2013, 9, 12), user)
+        self.assertEqual(
+            user[sample_date],
+            {'start': datetime.time(0, 5, 0), 'end': datetime.time(0, 6, 40)}
+        )
+        with self.assertRaises(KeyError):
+            user[datetime.date(2013, 9, 12)]  # pylint: disable=W0104
+
+        totals = [(0, 0, 0, 0)] * 7
+        totals[1] = (1, 100, 300, 400)
+        totals[2] = (1, 100, 500, 600)
+        self.assertEqual(user.weekday_totals(), totals)
+        self.assertEqual(
+            list(user.rows(sample_date.toordinal() + 1)),
+            [(sample_date.toordinal() + 1, 500, 600)]
+        )
+        self.assertEqual(list(user.rows(last=sample_date.toordinal() - 1)), [])
+        self.assertEqual(user.span(), (0, 2))
+        user.append(sample_date.toordinal() + 7, 0, 1000)
+        totals[1] = (2, 1100, 300, 1400)
+        self.assertEqual(user.weekday_totals(), totals)
+        self.assertEqual(user.copy().weekday_totals(), totals)
+
+        other = utils.UserPresence()
+        other.append(sample_date.toordinal() + 7, 0, 10)
+        other.append(sample_date.toordinal() + 14, 0, 10)
+        user.extend(other)
+        totals[1] = (3, 120, 300, 420)
+        self.assertEqual(user.weekday_totals(), totals)
+        self.assertEqual(len(user), 4)
+
+        self.assertEqual(
+            user.weekday_totals(sample_date.toordinal() + 1),
+            [(0, 0, 0, 0), (2, 20, 0, 20), (1, 100, 500, 600)] +
+            [(0, 0, 0, 0)] * 4
+        )
+        self.assertEqual(
+            user.weekday_totals(last=sample_date.toordinal() + 7),
+            [(0, 0, 0, 0), (2, 110, 300, 410), (1, 100, 500, 600)] +
+            [(0, 0, 0, 0)] * 4
+        )
+        self.assertEqual(
+            user.weekday_totals(sample_date.toordinal() - 7, 0),
+            [(0, 0, 0, 0)] * 7
+        )
+
+        pickled = pickle.loads(pickle.dumps(user, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(list(pickled.rows()), list(user.rows()))
+        self.assertEqual(pickled.weekday_totals(), totals)
+        self.assertEqual(pickled.rollup('weeks'), user.rollup('weeks'))
+
+    def test_weekday_totals(self):
+        """
+        Test weekday totals match grouping of user entries.
+        """
+        data = utils.get_data()
+        for user in data.values():
+            weekdays = utils.group_by_weekday(user)
+            start_end = utils.group_by_start_end(user)
+            self.assertEqual(
+                user.weekday_totals(),
+                [
+                    (
+                        len(weekdays[day]),
+                        sum(weekdays[day]),
+                        sum(start_end[day][0]),
+                        sum(start_end[day][1]),
+                    )
+                    for day in range(7)
+                ]
+            )
+
+    def test_warm_up(self):
+        """
+        Test loading data caches ahead of requests.
+        """
+        timings = utils.warm_up()
+        self.assertEqual(
+            [stage for stage, __ in timings],
+            ['presence data', 'users directory', 'static files']
+        )
+        self.assertIn('get_data', utils.CACHE)
+        self.assertIn(TEST_DATA_XML, utils.DIRECTORY)
+        self.assertEqual(utils.STATIC['folder'], main.app.static_folder)
+        utils.CACHE = {}
+
+        # broken users XML does not stop the startup
+        handle, path = tempfile.mkstemp(suffix='.xml')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        with open(TEST_DATA_XML, 'r') as xmlfile:
+            content = xmlfile.read()
+        with open(path, 'w') as xmlfile:
+            xmlfile.write(content[:len(content) // 2])
+        main.app.config.update({'DATA_XML': path})
+        timings = utils.warm_up()
+        self.assertEqual(
+            [stage for stage, __ in timings],
+            ['presence data', 'users directory (failed)', 'static files']
+        )
+        utils.CACHE = {}
+
+    def test_weekday(self):
+        """
+        Test weekday of day ordinal.
+        """
+        for day in range(7):
+            sample_date = datetime.date(2013, 9, 10) + datetime.timedelta(day)
+            self.assertEqual(
+                utils.weekday(sample_date.toordinal()),
+                sample_date.weekday()
+            )
+
+
+@unittest.skipIf(numpy_engine.numpy is None, 'numpy is not installed')
+class PresenceAnalyzerNumpyEngineTestCase(unittest.TestCase):
+    """
+    NumPy engine tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        main.app.config.update({'DATA_CSV': TEST_DATA_CSV})
+        main.app.config.update({'DATA_XML': TEST_DATA_XML})
+        main.app.config.update({'PRESENCE_ENGINE': 'numpy'})
+        self.client = main.app.test_client()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        main.app.config.update({'PRESENCE_ENGINE': 'python'})
+        utils.CACHE = {}
+
+    def test_totals(self):
+        """
+        Test totals are the same as computed by Python engine.
+        """
+        data = utils.get_data()
+        for user_id in data:
+            self.assertEqual(
+                numpy_engine.weekday_totals(data, user_id),
+                data[user_id].weekday_totals()
+            )
+        self.assertEqual(numpy_engine.organisation_totals(data), data.totals)
+        self.assertIs(
+            numpy_engine.get_arrays(data),
+            numpy_engine.get_arrays(utils.get_data())
+        )
+
+    def test_views(self):
+        """
+        Test views return the same results with NumPy engine.
+        """
+        for url in (
+                '/api/v1/mean_time_weekday/11',
+                '/api/v1/presence_weekday/10',
+                '/api/v2/total_hour/10',
+                '/api/v1/mean_time_start_end/11',
+        ):
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200)
+            main.app.config.update({'PRESENCE_ENGINE': 'python'})
+            self.assertEqual(resp.data, self.client.get(url).data)
+            main.app.config.update({'PRESENCE_ENGINE': 'numpy'})
+
 
 def suite():
     """
@@ -421,6 +1855,9 @@ def suite():
     base_suite = unittest.TestSuite()
     base_suite.addTest(unittest.makeSuite(PresenceAnalyzerViewsTestCase))
     base_suite.addTest(unittest.makeSuite(PresenceAnalyzerUtilsTestCase))
+    base_suite.addTest(
+        unittest.makeSuite(PresenceAnalyzerNumpyEngineTestCase)
+    )
     return base_suite
 
 
@@ -4,41 +4,374 @@ Helper functions used in views.
 """
 from __future__ import unicode_literals
 
+import os
 import csv
+import mmap
+import struct
+import hashlib
+import tempfile
 import time
+import locale
 import threading
-from json import dumps
+import urllib2
+import zlib
+import mimetypes
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import izip
+from collections import OrderedDict
+from multiprocessing import Pool, cpu_count
+from json import dumps, loads
 from functools import wraps
-from datetime import datetime
+from datetime import date, datetime
+from datetime import time as dtime
 from lxml import etree
 
-from flask import Response
+from flask import Response, request
+from werkzeug.exceptions import HTTPException
 
 from presence_analyzer.main import app
+from presence_analyzer import metrics, numpy_engine
 
 import logging
 log = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
 CACHE = {}
 LOCK = threading.Lock()
+LOADED = {}  # state of the last CSV load, see load_data()
+DIRECTORY = {}  # users loaded from XML file, see get_users()
+DIRECTORY_LOCK = threading.Lock()  # not LOCK, held during CSV loads
+MONTHS = {}  # day ordinal: month number, see month_of()
+STATIC = {}  # static files prepared for sending, see get_static()
+STATIC_LOCK = threading.Lock()
+POOL = {}  # worker processes parsing CSV chunks, see start_pool()
+COMPRESSIBLE_MIMETYPES = (
+    'application/javascript', 'application/json', 'image/svg+xml',
+)
+PARALLEL_MIN_SIZE = 1 << 20  # smaller CSV files are always read serially
+EXPORT_CHUNK_LINES = 1000  # lines of exported data sent at once
+RESPONSES = {  # serialized JSON responses, see jsonify()
+    'generation': None,
+    'bodies': OrderedDict(),  # ETag: body, least recently used first
+    'gzipped': {},  # ETag: gzip compressed body
+    'stats': {'hits': 0, 'misses': 0, 'stale': 0, 'evictions': 0},
+}
+RESPONSES_LOCK = threading.Lock()
+metrics.register_cache('jsonify', RESPONSES['stats'])
+SNAPSHOT_MAGIC = b'PRESNAP4'
+# magic, source inode, source size, source mtime, offset, number of users,
+# number of days
+SNAPSHOT_HEADER = struct.Struct(str('=8sQQdQQQ'))
+# user_id, first row, number of rows, weekday totals
+SNAPSHOT_USER = struct.Struct(str('=qQQ28q'))
+SNAPSHOT_ITEM = struct.Struct(str('=i'))  # single value of user column
+
+
+class RawJSON(bytes):
+    """
+    Already serialized JSON document, sent by jsonify as it is.
+    """
 
 
 def jsonify(function):
     """
     Creates a response with the JSON representation of wrapped function result.
+
+    Responses carry ETag and Last-Modified of loaded data. Conditional
+    requests matching them get '304 Not Modified' without calling the
+    wrapped function. Serialized results are cached by ETag, which covers
+    route, arguments and data generation, so repeated requests do not call
+    the wrapped function either. Results of at least GZIP_MIN_SIZE bytes
+    are sent compressed to clients accepting gzip, compressed once per
+    data generation. Count and duration of requests are recorded in
+    metrics by route.
     """
     @wraps(function)
     def inner(*args, **kwargs):
         """
         This docstring will be overridden by @wraps decorator.
         """
-        return Response(
-            dumps(function(*args, **kwargs)),
-            mimetype='application/json'
-        )
+        started = time.time()
+        status = 500
+        try:
+            response = respond(*args, **kwargs)
+            status = response.status_code
+            return response
+        except HTTPException as error:
+            status = error.code
+            raise
+        finally:
+            route = request.url_rule.rule if request.url_rule else request.path
+            metrics.increment(
+                'presence_requests_total', route=route, status=status
+            )
+            metrics.observe(
+                'presence_request_duration_seconds',
+                time.time() - started,
+                route=route
+            )
+
+    def respond(*args, **kwargs):
+        """
+        Returns JSON response or '304 Not Modified'.
+        """
+        generation, etag, modified = response_validators()
+        if is_not_modified(etag):
+            response = Response(status=304)
+            if request.if_none_match.is_strong(gzip_etag(etag)):
+                etag = gzip_etag(etag)
+        else:
+            result = cached_response(generation, etag)
+            if result is None:
+                result = function(*args, **kwargs)
+                if not isinstance(result, RawJSON):
+                    result = dumps(result, separators=(',', ':'))
+                cache_response(generation, etag, result)
+            response = Response(result, mimetype='application/json')
+            if len(result) >= app.config.get('GZIP_MIN_SIZE', 1024):
+                response.vary.add('Accept-Encoding')
+                if accepts_gzip():
+                    response.data = cached_gzip(generation, etag, result)
+                    response.content_encoding = 'gzip'
+                    etag = gzip_etag(etag)
+            if is_unchanged(modified):
+                response = Response(status=304)  # the resource exists
+        response.set_etag(etag)
+        response.last_modified = modified
+        response.cache_control.no_cache = True
+        return response
     return inner
 
 
+def data_generation():
+    """
+    Returns (generation, modified time) of loaded presence and users data.
+
+    Missing or unreadable users XML is left out, as most of JSON API does
+    not use it.
+    """
+    data = get_data()
+    try:
+        users = get_users()
+    except (KeyError, IOError, OSError, etree.LxmlError):
+        log.warning('Cannot read users XML', exc_info=True)
+        return '{0}.-'.format(data.generation), data.modified
+    return (
+        '{0}.{1}'.format(data.generation, users['generation']),
+        max(data.modified, users['modified'])
+    )
+
+
+def response_validators():
+    """
+    Returns (generation, ETag, Last-Modified) of current request to JSON API.
+    """
+    generation, modified = data_generation()
+    etag = hashlib.sha1('\n'.join((
+        generation,
+        request.path,
+        '&'.join(
+            '{0}={1}'.format(key, value)
+            for key, value in sorted(request.args.iteritems(multi=True))
+        ),
+    )).encode('utf-8')).hexdigest()
+    return generation, etag, datetime.utcfromtimestamp(int(modified))
+
+
+def cached_response(generation, etag):
+    """
+    Returns serialized JSON response with given ETag or None.
+    """
+    with RESPONSES_LOCK:
+        bodies = RESPONSES['bodies']
+        body = None
+        if RESPONSES['generation'] == generation:
+            body = bodies.pop(etag, None)
+        if body is None:
+            RESPONSES['stats']['misses'] += 1
+            return None
+        RESPONSES['stats']['hits'] += 1
+        bodies[etag] = body
+        return body
+
+
+def cached_gzip(generation, etag, body):
+    """
+    Returns gzip compressed body of cached response with given ETag.
+    """
+    with RESPONSES_LOCK:
+        compressed = RESPONSES['gzipped'].get(etag)
+    if compressed is None:
+        compressed = gzip_bytes(body)
+        with RESPONSES_LOCK:
+            if (
+                    RESPONSES['generation'] == generation and
+                    etag in RESPONSES['bodies']
+            ):
+                RESPONSES['gzipped'][etag] = compressed
+    return compressed
+
+
+def cache_response(generation, etag, body):
+    """
+    Saves serialized JSON response of given data generation.
+
+    Responses of older generations are dropped, at most JSON_CACHE_SIZE
+    least recently used responses are kept. Response of a request that
+    started before data was reloaded is not saved, so it cannot drop
+    responses of the current generation.
+    """
+    if generation != data_generation()[0]:
+        return
+    maxsize = app.config.get('JSON_CACHE_SIZE', 1024)
+    with RESPONSES_LOCK:
+        bodies = RESPONSES['bodies']
+        if RESPONSES['generation'] != generation:
+            RESPONSES['generation'] = generation
+            bodies.clear()
+            RESPONSES['gzipped'].clear()
+        bodies[etag] = RawJSON(body)
+        while len(bodies) > maxsize:
+            RESPONSES['gzipped'].pop(bodies.popitem(last=False)[0], None)
+            RESPONSES['stats']['evictions'] += 1
+
+
+def accepts_gzip():
+    """
+    Checks if client of current request accepts gzip encoding.
+    """
+    return request.accept_encodings['gzip'] > 0
+
+
+def gzip_bytes(content):
+    """
+    Compresses content in gzip format.
+
+    The gzip header carries no time, so equal content gives equal bytes.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(content) + compressor.flush()
+
+
+def gzip_etag(etag):
+    """
+    Returns ETag of gzip encoded representation.
+    """
+    return etag + '-gzip'
+
+
+def gzip_response(response):
+    """
+    Compresses response of at least GZIP_MIN_SIZE bytes for clients
+    accepting gzip.
+    """
+    if (
+            response.direct_passthrough or
+            response.content_encoding or
+            len(response.get_data()) < app.config.get('GZIP_MIN_SIZE', 1024)
+    ):
+        return response
+    response.vary.add('Accept-Encoding')
+    if accepts_gzip():
+        response.set_data(gzip_bytes(response.get_data()))
+        response.content_encoding = 'gzip'
+    return response
+
+
+def get_static():
+    """
+    Returns static files prepared once for sending.
+
+    It creates structure like this:
+    static = {
+        'folder': '/.../presence_analyzer/static',
+        'fingerprints': {'js/jquery.min.js': 'js/jquery.min.1a2b3c4d5e6f.js'},
+        'originals': {'js/jquery.min.1a2b3c4d5e6f.js': 'js/jquery.min.js'},
+        'gzipped': {'js/jquery.min.js': b'<gzip compressed file>'},
+        'etags': {'js/jquery.min.js': '1a2b3c...-gzip'},
+    }
+    Fingerprinted names carry hash of file content. Only text files of at
+    least GZIP_MIN_SIZE bytes are compressed.
+    """
+    folder = app.static_folder
+    if STATIC.get('folder') == folder:
+        return STATIC
+    with STATIC_LOCK:
+        if STATIC.get('folder') != folder:
+            static = load_static(folder)
+            STATIC.clear()
+            STATIC.update(static)
+    return STATIC
+
+
+def load_static(folder):
+    """
+    Prepares static files of given folder, see get_static().
+    """
+    minimum = app.config.get('GZIP_MIN_SIZE', 1024)
+    static = {
+        'folder': folder,
+        'fingerprints': {},
+        'originals': {},
+        'gzipped': {},
+        'etags': {},  # ETags of gzip encoded files
+    }
+    for directory, __, names in os.walk(folder):
+        for name in names:
+            path = os.path.join(directory, name)
+            filename = os.path.relpath(path, folder).replace(os.sep, '/')
+            with open(path, 'rb') as static_file:
+                content = static_file.read()
+            content_hash = hashlib.sha1(content).hexdigest()
+            fingerprinted = fingerprint(filename, content_hash)
+            static['fingerprints'][filename] = fingerprinted
+            static['originals'][fingerprinted] = filename
+
+            mimetype = mimetypes.guess_type(name)[0] or ''
+            if len(content) >= minimum and (
+                    mimetype.startswith('text/') or
+                    mimetype in COMPRESSIBLE_MIMETYPES
+            ):
+                static['gzipped'][filename] = gzip_bytes(content)
+                static['etags'][filename] = gzip_etag(content_hash)
+    return static
+
+
+def fingerprint(filename, content_hash):
+    """
+    Returns file name with hash of content before extension.
+    """
+    base, extension = os.path.splitext(filename)
+    return '{0}.{1}{2}'.format(base, content_hash[:12], extension)
+
+
+def is_not_modified(etag):
+    """
+    Checks if 'If-None-Match' header matches ETag of earlier response.
+
+    ETag of gzip encoded response matches too. Such ETag was sent only
+    with an existing resource, so it is answered before calling the view.
+    """
+    return bool(request.if_none_match) and (
+        request.if_none_match.is_strong(etag) or
+        request.if_none_match.is_strong(gzip_etag(etag))
+    )
+
+
+def is_unchanged(modified):
+    """
+    Checks if 'If-None-Match: *' or 'If-Modified-Since' header matches.
+
+    These match any resource, also one the view would reject, so they are
+    checked only after the view returned its result.
+    """
+    if request.if_none_match:
+        return request.if_none_match.star_tag
+    if request.if_modified_since:
+        return request.if_modified_since >= modified
+    return False
+
+
 def locker(function):
     """
     Starting new thread.
@@ -60,105 +393,1281 @@ def is_obsolete(entry, duration):
     return time.time() - entry['time'] > (float(duration) / 1000)
 
 
-def memoize(duration):
+def cache_key(function, args, kwargs):
+    """
+    Builds CACHE key of function call from its name and arguments.
+    """
+    if not args and not kwargs:
+        return function.__name__
+    return (function.__name__,) + args + tuple(sorted(kwargs.items()))
+
+
+def memoize(duration, maxsize=128, stale=False):
     """
-    Creating cache with users' data.
+    Caches results of function calls by arguments for duration (in ms).
+
+    At most 'maxsize' results are kept, least recently used are evicted.
+    With 'stale' set, obsolete result is still returned while a single
+    background thread computes the new one. Cache hits never wait on any
+    lock held during computation. Counters are in 'stats' attribute of
+    the decorated function, locks of keys being computed in 'computing',
+    each kept only while some call uses it.
     """
     def _memoize(function):
         """
         Taking a function.
         """
+        recent = OrderedDict()  # keys from least to most recently used
+        computing = {}  # key: [lock held while computed, number of users]
+        refreshing = set()  # keys refreshed in background
+        guard = threading.Lock()
+        stats = {'hits': 0, 'misses': 0, 'stale': 0, 'evictions': 0}
+
+        def use(key, counter):
+            """
+            Marks key as most recently used and updates counter.
+            """
+            with guard:
+                stats[counter] += 1
+                recent.pop(key, None)
+                recent[key] = True
+
+        def store(key, result):
+            """
+            Saves result in cache evicting least recently used entries.
+            """
+            CACHE[key] = {'value': result, 'time': time.time()}
+            with guard:
+                recent.pop(key, None)
+                recent[key] = True
+                while len(recent) > maxsize:
+                    CACHE.pop(recent.popitem(last=False)[0], None)
+                    stats['evictions'] += 1
+
+        def refresh(key, args, kw):
+            """
+            Computes new result in background thread.
+            """
+            try:
+                store(key, function(*args, **kw))
+            except Exception:  # pylint: disable=broad-except
+                log.exception('Refreshing %s failed', function.__name__)
+            finally:
+                with guard:
+                    refreshing.discard(key)
+
+        def revalidate(key, args, kw):
+            """
+            Starts background refresh unless one is already running.
+            """
+            with guard:
+                if key in refreshing:
+                    return
+                refreshing.add(key)
+            thread = threading.Thread(target=refresh, args=(key, args, kw))
+            thread.daemon = True
+            thread.start()
+
         @wraps(function)
         def __memoize(*args, **kw):
             """
             Creating cache.
             """
-            key = function.__name__
+            key = cache_key(function, args, kw)
 
-            if key in CACHE and not is_obsolete(CACHE[key], duration):
-                return CACHE[key]['value']
-            result = function(*args, **kw)
-            CACHE[key] = {'value': result, 'time': time.time()}
-            return result
+            entry = CACHE.get(key)
+            if entry is not None:
+                if not is_obsolete(entry, duration):
+                    use(key, 'hits')
+                    return entry['value']
+                if stale:
+                    use(key, 'stale')
+                    revalidate(key, args, kw)
+                    return entry['value']
+
+            with guard:
+                lock = computing.setdefault(key, [threading.Lock(), 0])
+                lock[1] += 1
+            try:
+                with lock[0]:
+                    entry = CACHE.get(key)
+                    if entry is not None and not is_obsolete(entry, duration):
+                        use(key, 'hits')
+                        return entry['value']
+                    with guard:
+                        stats['misses'] += 1
+                    result = function(*args, **kw)
+                    store(key, result)
+                    return result
+            finally:
+                with guard:
+                    lock[1] -= 1
+                    if not lock[1]:
+                        del computing[key]
+
+        __memoize.stats = stats
+        __memoize.computing = computing
+        metrics.register_cache(function.__name__, stats)
         return __memoize
     return _memoize
 
 
-@locker
-@memoize(600)
+class UserPresence(object):
+    """
+    Presence entries of a single user stored in compact columns.
+
+    Every entry is kept as three machine integers: day ordinal, start and
+    end in seconds since midnight. Columns are sorted by day and a day
+    occurs at most once, the last appended entry wins. Users loaded from
+    snapshot have read-only MappedColumn columns and must be copied before
+    any change.
+
+    Per weekday totals are kept up to date with every change, see
+    weekday_totals(). Totals of a range of days are computed from prefix
+    sums built on first such query and dropped on change. Week and month
+    rollups are summed from the columns on request, see rollup().
+
+    It can still be read like the old nested dict:
+    user[datetime.date(2013, 10, 1)]['start'] == datetime.time(9, 0, 0)
+    """
+    __slots__ = ('days', 'starts', 'ends', 'totals', 'index')
+
+    def __init__(self):
+        self.days = array(str('i'))
+        self.starts = array(str('i'))
+        self.ends = array(str('i'))
+        # [count, intervals, starts, ends] for every day in week
+        self.totals = [[0, 0, 0, 0] for __ in range(7)]
+        self.index = None  # see _weekday_index()
+
+    def append(self, day, start, end):
+        """
+        Adds entry for given day ordinal, replacing existing one.
+        """
+        self.index = None
+        days = self.days
+        if not days or day > days[-1]:
+            days.append(day)
+            self.starts.append(start)
+            self.ends.append(end)
+            self._count(day, start, end, 1)
+            return
+
+        position = bisect_left(days, day)
+        if days[position] == day:
+            self._count(day, self.starts[position], self.ends[position], -1)
+            self.starts[position] = start
+            self.ends[position] = end
+        else:
+            days.insert(position, day)
+            self.starts.insert(position, start)
+            self.ends.insert(position, end)
+        self._count(day, start, end, 1)
+
+    def _count(self, day, start, end, sign):
+        """
+        Adds (sign=1) or removes (sign=-1) entry from totals.
+        """
+        totals = self.totals[weekday(day)]
+        totals[0] += sign
+        totals[1] += sign * (end - start)
+        totals[2] += sign * start
+        totals[3] += sign * end
+
+    def rollup(self, period):
+        """
+        Returns {number: [count, intervals]} of 'weeks' or 'months'.
+
+        Weeks are numbered by week_of() and months by month_of(). Buckets
+        are summed from days between period boundaries found by bisection.
+        """
+        number_of, start_of = PERIODS[period]
+        days, starts, ends = self.days, self.starts, self.ends
+        buckets = {}
+        low = 0
+        while low < len(days):
+            key = number_of(days[low])
+            high = bisect_left(days, start_of(key + 1), low)
+            buckets[key] = [
+                high - low, sum(ends[low:high]) - sum(starts[low:high])
+            ]
+            low = high
+        return buckets
+
+    def weekday_totals(self, first=None, last=None):
+        """
+        Returns (count, intervals, starts, ends) sums for every weekday.
+
+        Optional 'first' and 'last' day ordinals limit days, inclusively.
+        """
+        if first is None and last is None:
+            return [tuple(totals) for totals in self.totals]
+
+        result = []
+        for days, intervals, starts, ends in self._weekday_index():
+            low = 0 if first is None else bisect_left(days, first)
+            high = len(days) if last is None else bisect_right(days, last)
+            if high <= low:
+                result.append((0, 0, 0, 0))
+                continue
+            result.append((
+                high - low,
+                int(intervals[high] - intervals[low]),
+                int(starts[high] - starts[low]),
+                int(ends[high] - ends[low]),
+            ))
+        return result
+
+    def _weekday_index(self):
+        """
+        Returns days and prefix sums of intervals, starts and ends of
+        every weekday, building them if needed.
+
+        Concurrent readers may build it twice, the index is assigned only
+        when complete and both are equal.
+        """
+        index = self.index
+        if index is None:
+            index = [
+                (array(str('i')), array(str('d'), [0]),
+                 array(str('d'), [0]), array(str('d'), [0]))
+                for __ in range(7)
+            ]
+            for day, start, end in self.rows():
+                days, intervals, starts, ends = index[weekday(day)]
+                days.append(day)
+                intervals.append(intervals[-1] + end - start)
+                starts.append(starts[-1] + start)
+                ends.append(ends[-1] + end)
+            self.index = index
+        return index
+
+    def extend(self, other):
+        """
+        Adds all entries of other user presence, they win on the same days.
+        """
+        if not other.days:
+            return
+        self.index = None
+        if self.days and other.days[0] <= self.days[-1]:
+            for day, start, end in other.rows():
+                self.append(day, start, end)
+            return
+
+        self.days.extend(other.days)
+        self.starts.extend(other.starts)
+        self.ends.extend(other.ends)
+        for totals, others in zip(self.totals, other.totals):
+            for i, value in enumerate(others):
+                totals[i] += value
+
+    def __getstate__(self):
+        return (
+            self.days.tostring(),
+            self.starts.tostring(),
+            self.ends.tostring(),
+            self.totals,
+        )
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.days.fromstring(state[0])
+        self.starts.fromstring(state[1])
+        self.ends.fromstring(state[2])
+        self.totals = state[3]
+
+    def copy(self):
+        """
+        Returns independent copy of the user entries.
+        """
+        other = UserPresence()
+        other.days = array(str('i'), self.days)
+        other.starts = array(str('i'), self.starts)
+        other.ends = array(str('i'), self.ends)
+        other.totals = [list(totals) for totals in self.totals]
+        return other
+
+    def rows(self, first=None, last=None):
+        """
+        Iterates over (day ordinal, start seconds, end seconds) tuples.
+
+        Optional 'first' and 'last' day ordinals limit days, inclusively.
+        """
+        if first is None and last is None:
+            return izip(self.days, self.starts, self.ends)
+        low, high = self.span(first, last)
+        return izip(
+            self.days[low:high], self.starts[low:high], self.ends[low:high]
+        )
+
+    def span(self, first=None, last=None):
+        """
+        Returns range of column indexes of days between first and last.
+        """
+        low = 0 if first is None else bisect_left(self.days, first)
+        high = len(self.days) if last is None else bisect_right(
+            self.days, last
+        )
+        return low, max(low, high)
+
+    def _position(self, key):
+        """
+        Returns column index of given date or None.
+        """
+        day = key.toordinal()
+        position = bisect_left(self.days, day)
+        if position < len(self.days) and self.days[position] == day:
+            return position
+        return None
+
+    def __len__(self):
+        return len(self.days)
+
+    def __iter__(self):
+        return (date.fromordinal(day) for day in self.days)
+
+    def __contains__(self, key):
+        return self._position(key) is not None
+
+    def __getitem__(self, key):
+        position = self._position(key)
+        if position is None:
+            raise KeyError(key)
+        return {
+            'start': time_from_seconds(self.starts[position]),
+            'end': time_from_seconds(self.ends[position]),
+        }
+
+    def keys(self):
+        """
+        Returns list of dates with presence entries.
+        """
+        return list(self)
+
+
+class MappedColumn(object):
+    """
+    Read-only column of 32-bit integers viewed in memory-mapped snapshot.
+
+    It is read like array('i') without copying values out of the map, so
+    processes loading the same snapshot share its pages. Slices are new
+    arrays. Users are copied before the first change, see read_presence().
+    """
+    __slots__ = ('buffer', 'length')
+
+    def __init__(self, mapped, offset, length):
+        self.buffer = buffer(mapped, offset, length * SNAPSHOT_ITEM.size)
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.length)
+            if step != 1:
+                return self[:][key]
+            item = SNAPSHOT_ITEM.size
+            column = array(str('i'))
+            column.fromstring(
+                self.buffer[start * item:max(start, stop) * item]
+            )
+            return column
+        if key < 0:
+            key += self.length
+        if not 0 <= key < self.length:
+            raise IndexError('column index out of range')
+        return SNAPSHOT_ITEM.unpack_from(
+            self.buffer, key * SNAPSHOT_ITEM.size
+        )[0]
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def tostring(self):
+        """
+        Returns values as machine bytes, like array.tostring().
+        """
+        return bytes(self.buffer)
+
+
+def add_buckets(target, source, sign=1):
+    """
+    Adds (sign=1) or subtracts (sign=-1) [count, intervals] rollup buckets.
+
+    Buckets left without entries are removed.
+    """
+    for key, (count, intervals) in source.iteritems():
+        add_bucket(target, key, sign * count, sign * intervals)
+
+
+def add_bucket(buckets, key, count, intervals):
+    """
+    Adds count and intervals to single rollup bucket.
+    """
+    bucket = buckets.get(key)
+    if bucket is None:
+        bucket = buckets[key] = [0, 0]
+    bucket[0] += count
+    bucket[1] += intervals
+    if not bucket[0]:
+        del buckets[key]
+
+
+def week_of(day):
+    """
+    Returns number of week, starting on Monday, of given day ordinal.
+    """
+    return (day - 1) // 7
+
+
+def month_of(day):
+    """
+    Returns number of month (year * 12 + month - 1) of given day ordinal.
+    """
+    month = MONTHS.get(day)
+    if month is None:
+        value = date.fromordinal(day)
+        month = MONTHS[day] = value.year * 12 + value.month - 1
+    return month
+
+
+def week_start(week):
+    """
+    Returns day ordinal of Monday starting given week number.
+    """
+    return week * 7 + 1
+
+
+def month_start(month):
+    """
+    Returns day ordinal of the first day of given month number.
+    """
+    return date(month // 12, month % 12 + 1, 1).toordinal()
+
+
+# period: (number of day ordinal, first day ordinal of number)
+PERIODS = {
+    'weeks': (week_of, week_start),
+    'months': (month_of, month_start),
+}
+
+
+def week_label(week):
+    """
+    Returns ISO week label, like '2013-W37', of given week number.
+    """
+    year, number, __ = date.fromordinal(week_start(week)).isocalendar()
+    return '{0}-W{1:02d}'.format(year, number)
+
+
+def month_label(month):
+    """
+    Returns label, like '2013-09', of given month number.
+    """
+    return '{0}-{1:02d}'.format(month // 12, month % 12 + 1)
+
+
+class PresenceData(dict):
+    """
+    UserPresence of every user keyed by user_id.
+
+    Also carries 'generation' identifying loaded data, 'modified' time of
+    the source file, 'totals', organisation-wide sums of intervals for
+    every weekday, 'rollups', organisation-wide rollups of 'weeks' and
+    'months' and 'index', organisation-wide days and prefix sums of
+    intervals of every weekday, all computed once per load and shared by
+    all requests.
+    """
+    def __init__(self, data, generation, modified, totals, rollups, index):
+        super(PresenceData, self).__init__(data)
+        self.generation = generation
+        self.modified = modified
+        self.totals = totals
+        self.rollups = rollups
+        self.index = index
+
+
+@memoize(600, stale=True)
 def get_data():
     """
     Extracts presence data from CSV file and groups it by user_id.
 
+    Loaded entries are never modified, so readers use them without
+    locking. The only exception is the index for ranges of days built
+    lazily by UserPresence.weekday_totals(). Two readers may both build
+    it, which is harmless: they build equal indexes and each assigns its
+    own with a single reference assignment.
+
+    Obsolete data is still returned while a single background thread
+    loads the next one, which then replaces cached data at once.
+
     It creates structure like this:
-    data = {
-        'user_id': {
-            datetime.date(2013, 10, 1): {
-                'start': datetime.time(9, 0, 0),
-                'end': datetime.time(17, 30, 0),
-            },
-            datetime.date(2013, 10, 2): {
-                'start': datetime.time(8, 30, 0),
-                'end': datetime.time(16, 45, 0),
-            },
-        }
-    }
+    data = PresenceData({
+        'user_id': UserPresence(
+            days=[735142, 735143],  # datetime.date(2013, 10, 1).toordinal()
+            starts=[32400, 30600],  # seconds since midnight
+            ends=[63000, 60300],
+        ),
+    })
+    """
+    return load_data(app.config['DATA_CSV'])
+
+
+def file_identity(path):
+    """
+    Returns (inode, size, mtime) of given file.
     """
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_size, stat.st_mtime
+
+
+@locker
+def load_data(path):
+    """
+    Loads presence data, parsing only rows appended since the last load.
+
+    The file is parsed from the beginning only when it is seen for the
+    first time or when it was truncated or replaced. Data returned by
+    earlier calls is never modified.
+    """
+    identity = file_identity(path)
+    previous = LOADED if LOADED.get('path') == path else {}
+    if previous and previous['identity'] == identity:
+        return _presence_data(previous)
+
+    started = time.time()
+    state = {'path': path, 'identity': identity, 'offset': 0}
     data = {}
-    with open(app.config['DATA_CSV'], 'r') as csvfile:
-        presence_reader = csv.reader(csvfile, delimiter=str(','))
-        for i, row in enumerate(presence_reader):
-            if len(row) != 4:
-                # ignore header and footer lines
-                continue
+    fresh = None  # all users are created by this load
+    mode = 'full'
+    if previous and is_appended(previous['identity'], identity):
+        state['offset'] = previous['offset']
+        data = dict(previous['data'])
+        fresh = set()
+        mode = 'incremental'
 
-            try:
-                user_id = int(row[0])
-                date = datetime.strptime(row[1], '%Y-%m-%d').date()
-                start = datetime.strptime(row[2], '%H:%M:%S').time()
-                end = datetime.strptime(row[3], '%H:%M:%S').time()
-            except (ValueError, TypeError):
-                log.debug('Problem with line %d: ', i, exc_info=True)
+    snapshot = app.config.get('DATA_SNAPSHOT', False) and fresh is None
+    loaded = snapshot and read_snapshot(path, identity)
+    workers = load_workers()
+    base = previous
+    if loaded:
+        # rows appended since the snapshot are parsed like incremental load
+        base = {'data': loaded[0], 'days': loaded[2]}
+        data = dict(loaded[0])
+        state['offset'] = loaded[1]
+        fresh = set()
+        snapshot = loaded[3] < identity[1]
+        mode = 'snapshot'
+    if fresh is None and workers > 1 and identity[1] >= PARALLEL_MIN_SIZE:
+        data, state['offset'] = read_presence_parallel(path, workers)
+        mode = 'parallel'
+    else:
+        with open(path, 'rb') as csvfile:
+            csvfile.seek(state['offset'])
+            read_presence(_track_offset(csvfile, state), data, fresh)
+    state['days'] = organisation_days(
+        data, base.get('data', {}), base.get('days'), fresh
+    )
+    if snapshot:
+        write_snapshot(path, identity, state['offset'], data, state['days'])
+
+    state['data'] = data
+    state['generation'] = identity_generation(identity)
+    state['totals'] = tuple(total_group_by_weekday(data))
+    state['rollups'] = organisation_rollups(state['days'])
+    state['index'] = weekday_index(state['days'])
+    LOADED.clear()
+    LOADED.update(state)
+
+    metrics.observe(
+        'presence_data_load_duration_seconds', time.time() - started, mode=mode
+    )
+    metrics.set_gauge('presence_data_users', len(data))
+    metrics.set_gauge(
+        'presence_data_rows', sum(len(user) for user in data.itervalues())
+    )
+    return _presence_data(state)
+
+
+def _presence_data(state):
+    """
+    Returns new PresenceData of given load state.
+    """
+    return PresenceData(
+        state['data'],
+        state['generation'],
+        state['identity'][2],
+        state['totals'],
+        state['rollups'],
+        state['index']
+    )
+
+
+def organisation_rollups(days):
+    """
+    Returns 'weeks' and 'months' rollups of {day: [count, intervals]} of
+    all users.
+    """
+    rollups = {'weeks': {}, 'months': {}}
+    for day, (count, intervals) in days.iteritems():
+        for period, buckets in rollups.iteritems():
+            add_bucket(buckets, PERIODS[period][0](day), count, intervals)
+    return rollups
+
+
+def organisation_days(data, previous_data, previous, fresh):
+    """
+    Returns {day ordinal: [count, intervals]} of all users, updating
+    previous days for 'fresh' users.
+
+    Without 'fresh' users set, days are summed from scratch.
+    """
+    days = {}
+    if fresh is None:
+        for user in data.itervalues():
+            add_rows(days, user.rows())
+        return days
+
+    add_buckets(days, previous)
+    for user_id in fresh:
+        user = data[user_id]
+        old_user = previous_data.get(user_id)
+        low = 0
+        if old_user is not None:
+            low = len(old_user)
+            if not all(
+                    getattr(user, column)[:low] == getattr(old_user, column)[:]
+                    for column in ('days', 'starts', 'ends')
+            ):
+                # rows were replaced or inserted, not only appended
+                add_rows(days, old_user.rows(), -1)
+                low = 0
+        add_rows(days, izip(
+            user.days[low:], user.starts[low:], user.ends[low:]
+        ))
+    return days
+
+
+def add_rows(days, rows, sign=1):
+    """
+    Adds (sign=1) or subtracts (sign=-1) rows to {day: [count, intervals]}.
+    """
+    for day, start, end in rows:
+        add_bucket(days, day, sign, sign * (end - start))
+
+
+def weekday_index(days):
+    """
+    Returns days and prefix sums of intervals of every weekday of
+    {day ordinal: [count, intervals]}.
+    """
+    index = [(array(str('i')), array(str('d'), [0])) for __ in range(7)]
+    for day in sorted(days):
+        weekdays, intervals = index[weekday(day)]
+        weekdays.append(day)
+        intervals.append(intervals[-1] + days[day][1])
+    return index
+
+
+def identity_generation(identity):
+    """
+    Returns generation string of data loaded from file with given identity.
+    """
+    return '{0:x}-{1:x}-{2:x}'.format(
+        identity[0], identity[1], int(identity[2] * 1000)
+    )
+
+
+def is_appended(previous, current):
+    """
+    Checks if file identity differs from previous one only by new rows.
+    """
+    return (
+        previous[0] == current[0] and
+        previous[1] < current[1] and
+        previous[2] <= current[2]
+    )
+
+
+def _track_offset(lines, state):
+    """
+    Yields lines counting the size of complete ones in state['offset'].
+
+    Unterminated last line is parsed, but it will be read again next time.
+    """
+    for line in lines:
+        if line.endswith(b'\n'):
+            state['offset'] += len(line)
+        yield line
+
+
+def snapshot_path(path):
+    """
+    Returns path of binary snapshot of given CSV file.
+    """
+    return path + '.snapshot'
+
+
+def write_snapshot(path, identity, offset, data, days):
+    """
+    Saves parsed data next to CSV file in binary snapshot.
+
+    The snapshot consists of a header, an index of users, columns of
+    days, starts and ends of all users stored as 32-bit integers and
+    organisation-wide days, counts and sums of intervals of every day.
+    """
+    user_ids = sorted(data)
+    day_keys = sorted(days)
+    parts = [SNAPSHOT_HEADER.pack(
+        SNAPSHOT_MAGIC, identity[0], identity[1], identity[2], offset,
+        len(user_ids), len(day_keys)
+    )]
+    first = 0
+    for user_id in user_ids:
+        user = data[user_id]
+        parts.append(SNAPSHOT_USER.pack(
+            user_id, first, len(user),
+            *[value for totals in user.totals for value in totals]
+        ))
+        first += len(user)
+    for column in ('days', 'starts', 'ends'):
+        parts.extend(
+            getattr(data[user_id], column).tostring() for user_id in user_ids
+        )
+    parts.append(array(str('i'), day_keys).tostring())
+    for typecode, i in (('i', 0), ('d', 1)):
+        parts.append(
+            array(str(typecode), [days[day][i] for day in day_keys]).tostring()
+        )
+
+    target = snapshot_path(path)
+    try:
+        write_atomically(target, b''.join(parts))
+    except (IOError, OSError):
+        log.warning('Cannot write snapshot %s', target, exc_info=True)
+
+
+def write_atomically(path, content):
+    """
+    Replaces file with content, so readers see either old or new file.
+
+    Content is written to a temporary file in the same directory, which
+    is then renamed over the target.
+    """
+    with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(path) or '.', delete=False
+    ) as output:
+        try:
+            output.write(content)
+            output.flush()
+            os.fsync(output.fileno())
+            os.chmod(output.name, 0o644)
+        except (IOError, OSError):
+            os.remove(output.name)
+            raise
+    os.rename(output.name, path)
+
+
+def read_snapshot(path, identity):
+    """
+    Loads data from binary snapshot made from CSV file of given identity.
+
+    The snapshot is valid also when rows were appended to the file since
+    it was made. Returns data, offset and organisation days as of the
+    snapshot and the size of the file it was made from, or None without
+    valid snapshot. The file is memory-mapped and user columns are
+    MappedColumn views of it, so processes read them from the shared page
+    cache.
+    """
+    try:
+        with open(snapshot_path(path), 'rb') as snapshot:
+            mapped = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return None
+
+    try:
+        magic, inode, size, mtime, offset, users, count = (
+            SNAPSHOT_HEADER.unpack_from(mapped)
+        )
+        if magic != SNAPSHOT_MAGIC or not (
+                inode == identity[0] and
+                size <= identity[1] and
+                mtime <= identity[2]
+        ):
+            return None
+
+        index = [
+            SNAPSHOT_USER.unpack_from(
+                mapped, SNAPSHOT_HEADER.size + i * SNAPSHOT_USER.size
+            )
+            for i in range(users)
+        ]
+        itemsize = SNAPSHOT_ITEM.size
+        rows = sum(entry[2] for entry in index)
+        columns = SNAPSHOT_HEADER.size + users * SNAPSHOT_USER.size
+        start = columns + 3 * rows * itemsize
+        if len(mapped) != start + count * (
+                2 * itemsize + array(str('d')).itemsize
+        ):
+            raise struct.error('unexpected snapshot size')
+        data = {}
+        for entry in index:
+            user = data[entry[0]] = UserPresence()
+            user.days, user.starts, user.ends = [
+                MappedColumn(
+                    mapped, columns + (i * rows + entry[1]) * itemsize,
+                    entry[2]
+                )
+                for i in range(3)
+            ]
+            user.totals = [list(entry[3 + i:7 + i]) for i in range(0, 28, 4)]
+
+        day_columns = []
+        for typecode in ('i', 'i', 'd'):
+            column = array(str(typecode))
+            column.fromstring(mapped[start:start + count * column.itemsize])
+            start += count * column.itemsize
+            day_columns.append(column)
+        days = dict(
+            (day, [day_count, int(intervals)])
+            for day, day_count, intervals in izip(*day_columns)
+        )
+        return data, offset, days, size
+    except (struct.error, ValueError):
+        log.warning('Snapshot of %s is corrupted', path, exc_info=True)
+        return None
+
+
+def load_workers():
+    """
+    Returns number of processes parsing CSV file, all CPUs when set to 0.
+    """
+    return app.config.get('DATA_LOAD_WORKERS', 1) or cpu_count()
+
+
+def start_pool():
+    """
+    Starts pool of processes used by read_presence_parallel().
+
+    It has to be called at startup, before any thread is started, as
+    forking a process while other threads hold locks may deadlock it.
+    """
+    workers = load_workers()
+    if workers > 1 and 'pool' not in POOL:
+        POOL['pool'] = Pool(workers)
+    return POOL.get('pool')
+
+
+def stop_pool():
+    """
+    Terminates pool of processes started by start_pool().
+    """
+    pool = POOL.pop('pool', None)
+    if pool is not None:
+        pool.terminate()
+        pool.join()
+
+
+def read_presence_parallel(path, workers):
+    """
+    Parses whole file in chunks by a pool of worker processes.
+
+    Uses the pool started by start_pool(). Without it a temporary pool is
+    forked only by the main thread, other threads parse chunks serially.
+
+    Returns data and offset after the last complete line. Chunks are
+    merged in file order, so the last row of a day still wins.
+    """
+    ranges = chunk_ranges(path, workers)
+    arguments = [(path, start, end) for start, end in ranges]
+    if 'pool' in POOL:
+        chunks = POOL['pool'].map(_read_chunk, arguments)
+    elif isinstance(threading.current_thread(), threading._MainThread):
+        pool = Pool(min(workers, len(ranges)) or 1)
+        try:
+            chunks = pool.map(_read_chunk, arguments)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        chunks = map(_read_chunk, arguments)
+
+    data = {}
+    for chunk, __ in chunks:
+        for user_id, user in chunk.iteritems():
+            if user_id in data:
+                data[user_id].extend(user)
+            else:
+                data[user_id] = user
+
+    # unterminated last line will be read again
+    offset = ranges[-1][0] + chunks[-1][1] if ranges else 0
+    return data, offset
+
+
+def chunk_ranges(path, count):
+    """
+    Splits file into at most 'count' byte ranges aligned on line starts.
+    """
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, 'rb') as csvfile:
+        for i in range(1, count):
+            csvfile.seek(max(size * i // count, bounds[-1]))
+            if csvfile.tell() > 0:
+                csvfile.seek(-1, os.SEEK_CUR)
+                csvfile.readline()  # rest of the line crossing the bound
+            bounds.append(csvfile.tell())
+    bounds.append(size)
+    return [
+        (start, end) for start, end in zip(bounds, bounds[1:]) if start < end
+    ]
+
+
+def _read_chunk(arguments):
+    """
+    Parses byte range of presence file, runs in worker process.
+
+    Returns data and length of the range up to the last complete line.
+    """
+    path, start, end = arguments
+    with open(path, 'rb') as csvfile:
+        csvfile.seek(start)
+        chunk = csvfile.read(end - start)
+    return read_presence(chunk.splitlines(True), {}), chunk.rfind(b'\n') + 1
 
-            data.setdefault(user_id, {})[date] = {'start': start, 'end': end}
+
+def read_presence(lines, data, fresh=None):
+    """
+    Parses presence rows from given lines into data.
+
+    Users already present in data that are not in 'fresh' set are copied
+    before the first change. None means every user in data is fresh.
+    """
+    days = {}
+    presence_reader = csv.reader(lines, delimiter=str(','))
+    for i, row in enumerate(presence_reader):
+        if len(row) != 4:
+            # ignore header and footer lines
+            continue
+
+        try:
+            user_id, day, start, end = parse_row(row, days)
+        except (ValueError, TypeError):
+            log.debug('Problem with line %d: ', i, exc_info=True)
+            continue
+
+        user = data.get(user_id)
+        if user is None:
+            user = data[user_id] = UserPresence()
+            if fresh is not None:
+                fresh.add(user_id)
+        elif fresh is not None and user_id not in fresh:
+            user = data[user_id] = user.copy()
+            fresh.add(user_id)
+        user.append(day, start, end)
 
     return data
 
 
+def parse_row(row, days=None):
+    """
+    Converts CSV row to (user_id, day ordinal, start, end) tuple.
+
+    Optional 'days' dict caches ordinals of already parsed dates.
+    Raises ValueError for malformed rows.
+    """
+    if days is None:
+        day = parse_day(row[1])
+    else:
+        day = days.get(row[1])
+        if day is None:
+            day = days[row[1]] = parse_day(row[1])
+    return int(row[0]), day, parse_seconds(row[2]), parse_seconds(row[3])
+
+
+def parse_day(text):
+    """
+    Converts 'YYYY-MM-DD' date to day ordinal.
+
+    Fixed layout is sliced directly, anything else goes through strptime.
+    """
+    if (
+            len(text) == 10 and text[4] == '-' and text[7] == '-' and
+            text[:4].isdigit() and text[5:7].isdigit() and
+            text[8:].isdigit()
+    ):
+        return date(int(text[:4]), int(text[5:7]), int(text[8:])).toordinal()
+    return datetime.strptime(text, '%Y-%m-%d').toordinal()
+
+
+def parse_seconds(text):
+    """
+    Converts 'HH:MM:SS' time to seconds since midnight.
+
+    Fixed layout is sliced directly, anything else goes through strptime.
+    """
+    if (
+            len(text) == 8 and text[2] == ':' and text[5] == ':' and
+            text[:2].isdigit() and text[3:5].isdigit() and
+            text[6:].isdigit()
+    ):
+        hour, minute, second = int(text[:2]), int(text[3:5]), int(text[6:])
+        if hour < 24 and minute < 60 and second < 60:
+            return hour * 3600 + minute * 60 + second
+    return seconds_since_midnight(datetime.strptime(text, '%H:%M:%S').time())
+
+
 def parse_xml():
     """
     Extracts users' name and avatar from given xml document.
+
+    The document is read in one streaming pass. Every user element is
+    removed from the tree once read, so memory does not grow with the
+    document.
     """
     data = {}
-    tree = etree.parse(app.config['DATA_XML'])
-    root = tree.getroot()
-    serv = ('{}://{}:{}'.format(
-        root.findtext('./server/protocol'),
-        root.findtext('./server/host'),
-        root.findtext('./server/port')
-        ))
-
-    for user in root.findall('./users/user'):
-        avatar = ''.join((serv, user.find('avatar').text))
-        name = user.find('name').text
-        data[int(user.get('id'))] = {'name': name, 'avatar': avatar}
+    server = {}
+    for __, element in etree.iterparse(
+            app.config['DATA_XML'], events=('end',), tag=('server', 'user')
+    ):
+        fields = {child.tag: child.text for child in element}
+        if element.tag == 'server':
+            server = fields
+            continue
+        data[int(element.get('id'))] = {
+            'name': fields['name'],
+            'avatar': fields['avatar'],
+        }
+        element.getparent().remove(element)
 
+    serv = '{protocol}://{host}:{port}'.format(**server)
+    for user in data.itervalues():
+        user['avatar'] = ''.join((serv, user['avatar']))
     return data
 
 
+def get_users():
+    """
+    Returns users directory, parsing DATA_XML again only when it changes.
+
+    It creates structure like this:
+    directory = {
+        'generation': '1a2b-3c4d-5e6f',
+        'modified': 1381305600.0,
+        'users': {141: {'name': 'Adam P.', 'avatar': 'https://...'}},
+        'sorted': [{'user_id': 141, 'name': 'Adam P.', 'avatar': '...'}],
+        'json': RawJSON('[{"user_id":141,...}]'),
+    }
+    Users in 'sorted' and 'json' are sorted by name in locale collation.
+    """
+    path = app.config['DATA_XML']
+    identity = file_identity(path)
+    generation = identity_generation(identity)
+    directory = DIRECTORY.get(path)
+    if directory is not None and directory['generation'] == generation:
+        return directory
+
+    with DIRECTORY_LOCK:
+        directory = DIRECTORY.get(path)
+        if directory is None or directory['generation'] != generation:
+            directory = load_users(identity)
+            DIRECTORY.clear()
+            DIRECTORY[path] = directory
+    return directory
+
+
+def load_users(identity):
+    """
+    Builds users directory from DATA_XML, see get_users().
+    """
+    users = parse_xml()
+    locale.setlocale(locale.LC_COLLATE, str(''))
+    encoding = locale.getlocale(locale.LC_COLLATE)[1] or 'utf-8'
+    keys = {
+        user_id: locale.strxfrm(user['name'].encode(encoding, 'replace'))
+        for user_id, user in users.items()
+    }
+    values = [
+        {
+            'user_id': user_id,
+            'name': users[user_id]['name'],
+            'avatar': users[user_id]['avatar']
+        }
+        for user_id in sorted(users, key=lambda key: (keys[key], key))
+    ]
+    return {
+        'generation': identity_generation(identity),
+        'modified': identity[2],
+        'users': users,
+        'sorted': values,
+        'json': RawJSON(dumps(values, separators=(',', ':'))),
+    }
+
+
+def update_xml(url, path, timeout=60):
+    """
+    Downloads users XML from url to path, only when it has changed.
+
+    Request is conditional on ETag and Last-Modified of the previous
+    download, recorded with the SHA-1 of content in a sidecar file. The
+    file is replaced atomically and only when its content differs, so
+    get_users() reparses it only after real changes.
+
+    Returns True if the file was replaced.
+    """
+    meta_path = xml_meta_path(path)
+    try:
+        with open(meta_path, 'r') as meta_file:
+            meta = loads(meta_file.read())
+    except (IOError, ValueError):
+        meta = {}
+    if not os.path.exists(path):
+        meta = {}
+
+    req = urllib2.Request(url)
+    if meta.get('etag'):
+        req.add_header('If-None-Match', meta['etag'])
+    if meta.get('last_modified'):
+        req.add_header('If-Modified-Since', meta['last_modified'])
+    try:
+        response = urllib2.urlopen(req, timeout=timeout)
+    except urllib2.HTTPError as error:
+        if error.code == 304:
+            log.debug('%s not modified', url)
+            return False
+        raise
+    try:
+        content = response.read()
+        headers = response.info()
+    finally:
+        response.close()
+
+    content_hash = hashlib.sha1(content).hexdigest()
+    replaced = content_hash != meta.get('sha1')
+    if replaced:
+        write_atomically(path, content)
+    write_atomically(meta_path, dumps({
+        'etag': headers.get('ETag'),
+        'last_modified': headers.get('Last-Modified'),
+        'sha1': content_hash,
+    }))
+    log.info('%s %s', path, 'updated' if replaced else 'not changed')
+    return replaced
+
+
+def xml_meta_path(path):
+    """
+    Returns path of file with download metadata of given users XML.
+    """
+    return path + '.meta'
+
+
+def warm_up():
+    """
+    Loads all data caches ahead of requests, logging time of every stage.
+
+    Errors of a stage are logged and the next stages still run, as failed
+    stage is only retried by requests later. Returns list of (stage,
+    seconds) tuples, with ' (failed)' appended to names of failed stages.
+    """
+    stages = [
+        ('presence data', get_data),
+        ('users directory', get_users),
+        ('static files', get_static),
+    ]
+    if app.config.get('PRESENCE_ENGINE') == 'numpy':
+        stages.append(
+            ('numpy arrays', lambda: numpy_engine.get_arrays(get_data()))
+        )
+
+    timings = []
+    for name, stage in stages:
+        started = time.time()
+        try:
+            stage()
+        except Exception:  # pylint: disable=broad-except
+            log.exception('Warm-up of %s failed', name)
+            name = '{0} (failed)'.format(name)
+        timings.append((name, time.time() - started))
+        log.info('Warm-up of %s took %.3f s', name, timings[-1][1])
+    return timings
+
+
+def export_presence(data, user_ids, first=None, last=None, fmt='ndjson'):
+    """
+    Yields chunks of presence entries of given users as NDJSON or CSV.
+
+    Every NDJSON line is an object with 'user_id', 'date', 'start' and
+    'end' keys. CSV starts with a header line of the same columns.
+    """
+    dates = {}
+    if fmt == 'csv':
+        yield b'user_id,date,start,end\r\n'
+        line = '{0},{1},{2},{3}\r\n'
+    else:
+        line = (
+            '{{"user_id": {0}, "date": "{1}", '
+            '"start": "{2}", "end": "{3}"}}\n'
+        )
+
+    for user_id in user_ids:
+        lines = []
+        for day, start, end in data[user_id].rows(first, last):
+            text = dates.get(day)
+            if text is None:
+                text = dates[day] = date.fromordinal(day).isoformat()
+            lines.append(line.format(
+                user_id, text, format_seconds(start), format_seconds(end)
+            ))
+            if len(lines) >= EXPORT_CHUNK_LINES:
+                yield ''.join(lines).encode('utf-8')
+                lines = []
+        if lines:
+            yield ''.join(lines).encode('utf-8')
+
+
+def weekday_totals(data, user_id, first=None, last=None):
+    """
+    Returns per weekday totals of given user from configured engine.
+
+    Optional 'first' and 'last' day ordinals limit days, inclusively.
+    """
+    if first is None and last is None:
+        if app.config.get('PRESENCE_ENGINE') == 'numpy':
+            return numpy_engine.weekday_totals(data, user_id)
+    return data[user_id].weekday_totals(first, last)
+
+
+def organisation_totals(data, first=None, last=None):
+    """
+    Returns weekday sums of intervals of all users from configured engine.
+
+    Optional 'first' and 'last' day ordinals limit days, inclusively.
+    """
+    if first is None and last is None:
+        if app.config.get('PRESENCE_ENGINE') == 'numpy':
+            return numpy_engine.organisation_totals(data)
+        return data.totals
+
+    result = []
+    for days, intervals in data.index:
+        low = 0 if first is None else bisect_left(days, first)
+        high = len(days) if last is None else bisect_right(days, last)
+        result.append(int(intervals[max(low, high)] - intervals[low]))
+    return tuple(result)
+
+
 def total_group_by_weekday(items):
     """
     Groups presence total users entries by weekday.
     """
-    result = [[] for i in range(7)]  # one list for every day in week
+    result = [0] * 7  # one total for every day in week
 
     for value in items.values():
-        for date, item in value.items():
-            start = item['start']
-            end = item['end']
-            result[date.weekday()].append(interval(start, end))
-
-    result = [sum(items) for items in result]
+        for day, totals in enumerate(value.weekday_totals()):
+            result[day] += totals[1]
 
     return result
 
@@ -168,13 +1677,18 @@ def group_by_weekday(items):
     Groups presence entries by weekday.
     """
     result = [[], [], [], [], [], [], []]  # one list for every day in week
-    for date in items:
-        start = items[date]['start']
-        end = items[date]['end']
-        result[date.weekday()].append(interval(start, end))
+    for day, start, end in items.rows():
+        result[weekday(day)].append(end - start)
     return result
 
 
+def weekday(day):
+    """
+    Returns weekday of given day ordinal, Monday is 0.
+    """
+    return (day + 6) % 7
+
+
 def seconds_since_midnight(timer):
     """
     Calculates amount of seconds since midnight.
@@ -182,6 +1696,22 @@ def seconds_since_midnight(timer):
     return timer.hour * 3600 + timer.minute * 60 + timer.second
 
 
+def time_from_seconds(seconds):
+    """
+    Converts seconds since midnight to datetime.time object.
+    """
+    return dtime(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def format_seconds(seconds):
+    """
+    Formats seconds since midnight as 'HH:MM:SS'.
+    """
+    return '{0:02d}:{1:02d}:{2:02d}'.format(
+        seconds // 3600, seconds // 60 % 60, seconds % 60
+    )
+
+
 def interval(start, end):
     """
     Calculates inverval in seconds between two datetime.time objects.
@@ -193,7 +1723,21 @@ def mean(items):
     """
     Calculates arithmetic mean. Returns zero for empty lists.
     """
-    return float(sum(items)) / len(items) if len(items) > 0 else 0
+    return mean_of(sum(items), len(items))
+
+
+def hours(seconds):
+    """
+    Converts seconds to hours rounded to two decimal places.
+    """
+    return float("%0.2f" % (float(seconds) / 3600))
+
+
+def mean_of(total, count):
+    """
+    Calculates arithmetic mean from sum and count. Returns zero for no items.
+    """
+    return float(total) / count if count > 0 else 0
 
 
 def group_by_start_end(items):
@@ -202,11 +1746,8 @@ def group_by_start_end(items):
     """
     result = {key: [[], []] for key in range(7)}
 
-    for date in items:
-        result[date.weekday()][0].append(
-            seconds_since_midnight(items[date]['start'])
-        )
-        result[date.weekday()][1].append(
-            seconds_since_midnight(items[date]['end']))
+    for day, start, end in items.rows():
+        result[weekday(day)][0].append(start)
+        result[weekday(day)][1].append(end)
 
     return result
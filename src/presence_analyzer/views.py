@@ -5,20 +5,28 @@ Defines views.
 
 import calendar
 import logging
-import locale
-from flask import redirect, abort
+import mimetypes
+from flask import redirect, abort, request, Response
 from flask.ext.mako import MakoTemplates, render_template
 from mako.exceptions import TopLevelLookupException
 
 from presence_analyzer.main import app
+from presence_analyzer import metrics
 from presence_analyzer.utils import (
     jsonify,
     get_data,
-    mean,
-    group_by_weekday,
-    total_group_by_weekday,
-    group_by_start_end,
-    parse_xml
+    hours,
+    week_label,
+    month_label,
+    export_presence,
+    parse_day,
+    mean_of,
+    weekday_totals,
+    organisation_totals,
+    get_users,
+    get_static,
+    accepts_gzip,
+    gzip_response
 )
 
 mako = MakoTemplates(app)
@@ -47,11 +55,60 @@ def viewer(template):
     }
 
     try:
-        return render_template(template+'.html', selected=template, base=sites)
+        return gzip_response(app.make_response(
+            render_template(template+'.html', selected=template, base=sites)
+        ))
     except TopLevelLookupException:
         abort(404)
 
 
+def static_view(filename):
+    """
+    Sends static file, precompressed for clients accepting gzip.
+
+    Fingerprinted file names, see helpers.static_url(), never change
+    content, so they are cached by browsers for a year without
+    revalidation. In debug mode files are sent as they are on disk, so
+    edits are seen without restart.
+    """
+    if app.debug:
+        return app.send_static_file(filename)
+    static = get_static()
+    original = static['originals'].get(filename)
+    if original is not None:
+        filename = original
+    gzipped = static['gzipped'].get(filename)
+    if gzipped is None or not accepts_gzip():
+        response = app.send_static_file(filename)
+    else:
+        response = Response(
+            gzipped, mimetype=mimetypes.guess_type(filename)[0]
+        )
+        response.content_encoding = 'gzip'
+        response.cache_control.public = True
+        response.cache_control.max_age = app.get_send_file_max_age(filename)
+        response.set_etag(static['etags'][filename])
+        response.make_conditional(request)
+    if gzipped is not None:
+        response.vary.add('Accept-Encoding')
+    if original is not None:
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+app.view_functions['static'] = static_view
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_view():
+    """
+    Returns request, cache and data load metrics for Prometheus.
+    """
+    return Response(
+        metrics.render(), mimetype='text/plain; version=0.0.4'
+    )
+
+
 @app.route('/api/v1/users', methods=['GET'])
 @jsonify
 def users_view():
@@ -71,19 +128,7 @@ def users_view2():
     """
     Users listing for dropdown.
     """
-    locale.setlocale(locale.LC_COLLATE, "")
-    data = parse_xml()
-    values = [
-        {
-            'user_id': user_id,
-            'name': data[user_id]['name'],
-            'avatar': data[user_id]['avatar']
-        }
-        for user_id in data.keys()
-    ]
-    values.sort(key=lambda x: x['name'], cmp=locale.strcoll)
-
-    return values
+    return get_users()['json']
 
 
 @app.route('/api/v1/mean_time_weekday/<int:user_id>', methods=['GET'])
@@ -91,19 +136,15 @@ def users_view2():
 def mean_time_weekday_view(user_id):
     """
     Returns mean presence time of given user grouped by weekday.
+
+    Optional 'from' and 'to' dates (YYYY-MM-DD) limit days.
     """
     data = get_data()
     if user_id not in data:
         log.debug('User %s not found!', user_id)
         abort(404)
 
-    weekdays = group_by_weekday(data[user_id])
-    result = [
-        (calendar.day_abbr[weekday], mean(intervals))
-        for weekday, intervals in enumerate(weekdays)
-    ]
-
-    return result
+    return mean_time_weekday(data, user_id, *date_range_arguments())
 
 
 @app.route('/api/v1/presence_weekday/<int:user_id>', methods=['GET'])
@@ -111,20 +152,15 @@ def mean_time_weekday_view(user_id):
 def presence_weekday_view(user_id):
     """
     Returns total presence time of given user grouped by weekday.
+
+    Optional 'from' and 'to' dates (YYYY-MM-DD) limit days.
     """
     data = get_data()
     if user_id not in data:
         log.debug('User %s not found!', user_id)
         abort(404)
 
-    weekdays = group_by_weekday(data[user_id])
-    result = [
-        (calendar.day_abbr[weekday], sum(intervals))
-        for weekday, intervals in enumerate(weekdays)
-    ]
-
-    result.insert(0, ('Weekday', 'Presence (s)'))
-    return result
+    return presence_weekday(data, user_id, *date_range_arguments())
 
 
 @app.route('/api/v2/total_hour/<int:user_id>', methods=['GET'])
@@ -132,6 +168,8 @@ def presence_weekday_view(user_id):
 def presence_total_hour(user_id):
     """
     Returns user daily time and total daily time of all users.
+
+    Optional 'from' and 'to' dates (YYYY-MM-DD) limit days.
     """
     data = get_data()
 
@@ -139,20 +177,7 @@ def presence_total_hour(user_id):
         log.debug('User %s not found!', user_id)
         abort(404)
 
-    get_total_hours = total_group_by_weekday(data)
-
-    weekdays = group_by_weekday(data[user_id])
-    result = [
-        (
-            calendar.day_abbr[weekday],
-            float("%0.2f" % (float(sum(intervals)) / 3600)),
-            float("%0.2f" % (float(get_total_hours[weekday]) / 3600))
-        )
-        for weekday, intervals in enumerate(weekdays)
-    ]
-
-    result.insert(0, ('Weekday', 'User hours', 'Total hours'))
-    return result
+    return total_hour(data, user_id, *date_range_arguments())
 
 
 @app.route('/api/v1/mean_time_start_end/<int:user_id>', methods=['GET'])
@@ -160,21 +185,254 @@ def presence_total_hour(user_id):
 def presence_start_end_view(user_id):
     """
     Returns total time of given user grouped by start end.
+
+    Optional 'from' and 'to' dates (YYYY-MM-DD) limit days.
     """
     data = get_data()
     if user_id not in data:
         log.debug('User %s not found!', user_id)
         abort(404)
 
-    weekdays = group_by_start_end(data[user_id])
+    return mean_time_start_end(data, user_id, *date_range_arguments())
+
+
+@app.route('/api/v2/weekly', defaults={'user_id': None}, methods=['GET'])
+@app.route('/api/v2/weekly/<int:user_id>', methods=['GET'])
+@jsonify
+def weekly_view(user_id):
+    """
+    Returns hours of given user and of all users by ISO week.
+
+    Without user only hours of all users are returned.
+    """
+    return rollup_view(user_id, 'weeks')
+
+
+@app.route('/api/v2/monthly', defaults={'user_id': None}, methods=['GET'])
+@app.route('/api/v2/monthly/<int:user_id>', methods=['GET'])
+@jsonify
+def monthly_view(user_id):
+    """
+    Returns hours of given user and of all users by month.
+
+    Without user only hours of all users are returned.
+    """
+    return rollup_view(user_id, 'months')
+
+
+def rollup_view(user_id, period):
+    """
+    Returns total and mean daily hours by 'weeks' or 'months'.
+    """
+    data = get_data()
+    if user_id is not None and user_id not in data:
+        log.debug('User %s not found!', user_id)
+        abort(404)
+
+    label, title = ROLLUP_LABELS[period]
+    organisation = data.rollups[period]
+    if user_id is None:
+        result = [
+            (label(key), hours(total), hours(mean_of(total, count)))
+            for key, (count, total) in sorted(organisation.iteritems())
+        ]
+        result.insert(0, (title, 'Total hours', 'Mean hours'))
+        return result
 
     result = [
         (
-            calendar.day_abbr[key],
-            mean(weekdays[key][0]),
-            mean(weekdays[key][1])
+            label(key),
+            hours(intervals),
+            hours(mean_of(intervals, count)),
+            hours(organisation[key][1]),
+            hours(mean_of(organisation[key][1], organisation[key][0]))
+        )
+        for key, (count, intervals) in sorted(
+            data[user_id].rollup(period).iteritems()
         )
-        for key in weekdays
     ]
+    result.insert(
+        0,
+        (title, 'User hours', 'User mean hours', 'Total hours', 'Mean hours')
+    )
+    return result
+
+
+@app.route('/api/v2/stats', methods=['GET'])
+@jsonify
+def stats_view():
+    """
+    Returns chosen statistics of many users at once.
+
+    Users are given as 'user_id' and statistics as 'stat' parameters,
+    repeated or comma separated. All statistics are returned by default,
+    together with name and avatar of every user under 'user' key. Users
+    without presence data are listed in 'missing'. Optional 'from' and 'to'
+    dates (YYYY-MM-DD) limit days.
+    """
+    try:
+        user_ids = [
+            int(user_id) for user_id in split_arguments('user_id')
+        ]
+    except ValueError:
+        abort(400)
+    stats = split_arguments('stat') or sorted(STATISTICS)
+    if any(stat not in STATISTICS for stat in stats):
+        abort(400)
+    first, last = date_range_arguments()
+
+    data = get_data()
+    users = get_users()['users']
+    result = {'users': {}, 'missing': []}
+    for user_id in user_ids:
+        if user_id not in data:
+            result['missing'].append(user_id)
+            continue
+        result['users'][user_id] = {
+            stat: STATISTICS[stat](data, user_id, first, last)
+            for stat in stats
+        }
+        result['users'][user_id]['user'] = users.get(user_id)
 
     return result
+
+
+@app.route('/api/v2/export', methods=['GET'])
+def export_view():
+    """
+    Streams daily start and end of users as NDJSON or CSV.
+
+    Optional 'format' is 'ndjson' (default) or 'csv'. Users can be chosen
+    by 'user_id', repeated or comma separated, and days by 'from' and 'to'
+    dates in 'YYYY-MM-DD' format, both inclusive.
+    """
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_MIMETYPES:
+        abort(400)
+    try:
+        user_ids = [
+            int(user_id) for user_id in split_arguments('user_id')
+        ]
+    except ValueError:
+        abort(400)
+    first, last = date_range_arguments()
+
+    data = get_data()
+    user_ids = sorted(
+        user_id for user_id in user_ids or data if user_id in data
+    )
+    return Response(
+        export_presence(data, user_ids, first, last, fmt),
+        mimetype=EXPORT_MIMETYPES[fmt]
+    )
+
+
+def date_range_arguments():
+    """
+    Returns day ordinals of 'from' and 'to' request arguments or None.
+    """
+    try:
+        return tuple(
+            parse_day(request.args[name]) if request.args.get(name) else None
+            for name in ('from', 'to')
+        )
+    except ValueError:
+        abort(400)
+
+
+def split_arguments(name):
+    """
+    Returns values of repeated or comma separated request argument.
+    """
+    return [
+        value
+        for argument in request.args.getlist(name)
+        for value in argument.split(',')
+        if value
+    ]
+
+
+def mean_time_weekday(data, user_id, first=None, last=None):
+    """
+    Mean presence time of given user grouped by weekday.
+    """
+    return [
+        (calendar.day_abbr[weekday], mean_of(intervals, count))
+        for weekday, (count, intervals, __, __) in enumerate(
+            weekday_totals(data, user_id, first, last)
+        )
+    ]
+
+
+def presence_weekday(data, user_id, first=None, last=None):
+    """
+    Total presence time of given user grouped by weekday.
+    """
+    result = [
+        (calendar.day_abbr[weekday], intervals)
+        for weekday, (__, intervals, __, __) in enumerate(
+            weekday_totals(data, user_id, first, last)
+        )
+    ]
+
+    result.insert(0, ('Weekday', 'Presence (s)'))
+    return result
+
+
+def total_hour(data, user_id, first=None, last=None):
+    """
+    User daily hours and total daily hours of all users.
+    """
+    totals = organisation_totals(data, first, last)
+    result = [
+        (
+            calendar.day_abbr[weekday],
+            hours(intervals),
+            hours(totals[weekday])
+        )
+        for weekday, (__, intervals, __, __) in enumerate(
+            weekday_totals(data, user_id, first, last)
+        )
+    ]
+
+    result.insert(0, ('Weekday', 'User hours', 'Total hours'))
+    return result
+
+
+def mean_time_start_end(data, user_id, first=None, last=None):
+    """
+    Mean start and end time of given user grouped by weekday.
+    """
+    return [
+        (
+            calendar.day_abbr[weekday],
+            mean_of(starts, count),
+            mean_of(ends, count)
+        )
+        for weekday, (count, __, starts, ends) in enumerate(
+            weekday_totals(data, user_id, first, last)
+        )
+    ]
+
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+ROLLUP_LABELS = {
+    'weeks': (week_label, 'Week'),
+    'months': (month_label, 'Month'),
+}
+
+
+EXPORT_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+STATISTICS = {
+    'mean_time_weekday': mean_time_weekday,
+    'presence_weekday': presence_weekday,
+    'total_hour': total_hour,
+    'mean_time_start_end': mean_time_start_end,
+}